@@ -0,0 +1,35 @@
+"""
+Compares encrypting and decrypting a vault by running gpg with doing it
+in-process.
+
+    $ python benchmarks/bench_crypto.py [number of records]
+"""
+import sys
+import timeit
+
+from sdb import openpgp
+from sdb.passwords import SubprocessBackend, OpenPGPBackend, pack, gen_password
+
+
+def make_records(n):
+    return [
+        ('domain%d.com' % i, 'user%d' % (i % 20), gen_password(length=20), '')
+        for i in range(n)
+    ]
+
+
+def main(n=1000):
+    data = pack(make_records(n))
+    print('%d records, %d bytes, cryptography %s' % (
+        n, len(data), 'installed' if openpgp.FAST else 'not installed'))
+    for name, backend in [('gpg', SubprocessBackend()), ('openpgp', OpenPGPBackend())]:
+        encrypted = backend.encrypt('password', data)
+        assert backend.decrypt('password', encrypted) == data
+        for op, f in [('encrypt', lambda: backend.encrypt('password', data)),
+                      ('decrypt', lambda: backend.decrypt('password', encrypted))]:
+            t = min(timeit.repeat(f, number=1, repeat=5))
+            print('%-10s %-10s %8.1f ms' % (name, op, t * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+"""
+Compares decoding the repr format with ast.literal_eval, with sdb.literal, and
+decoding the packed format.
+
+    $ python benchmarks/bench_decode.py [number of records]
+"""
+import ast
+import sys
+import timeit
+
+from sdb.passwords import encode, pack, decode, gen_password
+
+
+def make_records(n):
+    return [
+        ('domain%d.com' % i, 'user%d' % (i % 20), gen_password(length=20),
+         'some notes\nabout "this" account' if i % 3 else '')
+        for i in range(n)
+    ]
+
+
+def ast_decode(data):
+    return [ast.literal_eval(line) for line in data.decode('utf-8').split('\n') if line]
+
+
+def main(n=50000):
+    records = make_records(n)
+    data = encode(records)
+    packed = pack(records)
+    assert decode(data) == ast_decode(data) == decode(packed)
+    for name, f, d in [('ast.literal_eval', ast_decode, data),
+                       ('sdb.literal', decode, data),
+                       ('packed', decode, packed)]:
+        t = min(timeit.repeat(lambda: f(d), number=1, repeat=3))
+        print('%-20s %8.1f ms  %10.0f records/s' % (name, t * 1000, n / t))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
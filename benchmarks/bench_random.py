@@ -0,0 +1,46 @@
+"""
+Compares generating passwords with RandomSource, as gen_password() does,
+with SystemRandom.choice() a character at a time, as it used to, and shows
+how fast gen_passwords() and gen_passphrases() make lots of them, as
+`sdb gen -n` does.
+
+    $ python benchmarks/bench_random.py [number of passwords]
+"""
+import sys
+import timeit
+import random
+
+from sdb.passwords import gen_password, gen_passwords, gen_passphrases, WORDS, ALPHANUMERIC, EVERYTHING
+from sdb.randomness import RandomSource
+
+system_random = random.SystemRandom()
+
+
+def system_random_password(choices, length):
+    return ''.join(system_random.choice(choices) for i in range(length))
+
+
+def main(n=10000):
+    for length in (10, 20, 64):
+        for name, choices in [('alphanumeric', ALPHANUMERIC), ('everything', EVERYTHING), ('digits', '0123456789')]:
+            old = min(timeit.repeat(lambda: system_random_password(choices, length), number=n, repeat=3))
+            new = min(timeit.repeat(lambda: gen_password(choices, length), number=n, repeat=3))
+            print('%2d characters of %-12s SystemRandom %9.0f/s   RandomSource %9.0f/s' % (
+                length, name, n / old, n / new))
+    source = RandomSource()
+    seconds = min(timeit.repeat(lambda: source.indices(62, 10 ** 6), number=1, repeat=3))
+    print('%.1f million characters/s in bulk' % (1 / seconds))
+    for requirements in (None, ['0123456789', '!@#$%^&*']):
+        seconds = min(timeit.repeat(
+            lambda: list(gen_passwords(n * 10, EVERYTHING, requirements=requirements)),
+            number=1, repeat=3))
+        print('gen_passwords(requirements=%r): %.0f/s' % (requirements, n * 10 / seconds))
+    old = min(timeit.repeat(
+        lambda: [' '.join(system_random.choice(WORDS) for i in range(10)) for j in range(n)],
+        number=1, repeat=3))
+    new = min(timeit.repeat(lambda: list(gen_passphrases(n, words=10)), number=1, repeat=3))
+    print('10 word passphrases: SystemRandom %.0f/s   gen_passphrases %.0f/s' % (n / old, n / new))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,73 @@
+"""
+Compares gen_password_require(), which picks each character knowing what's
+still required, with generating whole passwords until one has everything,
+as it used to, for more and more required characters and classes. The loop
+gets at most LOOP_SECONDS for each case.
+
+    $ python benchmarks/bench_require.py [number of passwords]
+"""
+import sys
+import time
+import string
+import timeit
+
+from sdb.passwords import (
+    gen_password, gen_password_require, requirement_classes, EVERYTHING, ALPHANUMERIC)
+
+LOOP_SECONDS = 10
+
+CASES = [
+    ('a', ALPHANUMERIC, 10),
+    ('ab', ALPHANUMERIC, 10),
+    ('!@#', EVERYTHING, 10),
+    ('!@#$%', EVERYTHING, 8),
+    ('!@#$%^&', EVERYTHING, 8),
+    ('!@#$%^&*', EVERYTHING, 8),
+    ([string.digits, string.punctuation, string.ascii_uppercase], EVERYTHING, 4),
+    ([string.digits, string.punctuation, string.ascii_uppercase, string.ascii_lowercase], EVERYTHING, 6),
+    ('abcdefghij', ALPHANUMERIC, 12),
+    # too many to count by subset, but single characters are interchangeable
+    (string.ascii_lowercase, ALPHANUMERIC, 32),
+    (string.punctuation, EVERYTHING, 40),
+]
+
+
+def rejection_require(requirements, choices, length, deadline):
+    """
+    Returns the password and how many tries it took, or None and the tries
+    if time runs out first.
+    """
+    classes = requirement_classes(requirements)
+    tries = 0
+    while time.time() < deadline:
+        tries += 1
+        pw = gen_password(choices, length)
+        if all(set(pw) & requirement for requirement in classes):
+            return pw, tries
+    return None, tries
+
+
+def main(n=200):
+    for requirements, choices, length in CASES:
+        worst = 0
+        total = 0
+        done = 0
+        start = time.time()
+        while done < n:
+            pw, tries = rejection_require(requirements, choices, length, start + LOOP_SECONDS)
+            worst = max(worst, tries)
+            total += tries
+            if pw is None:
+                break
+            done += 1
+        # when it gave up, it took at least this long for each one
+        old = (time.time() - start) / max(done, 1)
+        new = min(timeit.repeat(
+            lambda: gen_password_require(requirements, choices, length), number=n, repeat=3)) / n
+        print('%-28s %2d chars   loop %9.3f ms (%9.1f tries, worst %7d, %3d made)   require %6.3f ms' % (
+            str(requirements)[:28], length, old * 1000, total / float(max(done, 1)), worst, done,
+            new * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
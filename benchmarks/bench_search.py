@@ -0,0 +1,74 @@
+"""
+Compares search() with search() for the top 20, with SearchIndex, and with
+BulkSearcher if numpy is installed, for 1k, 100k and 1M records. Then
+compares typing a term with IncrementalSearcher with searching again after
+every key.
+
+    $ python benchmarks/bench_search.py [number of records...]
+"""
+import sys
+import time
+import timeit
+import random
+
+from sdb.passwords import search, gen_password
+from sdb.index import SearchIndex
+from sdb.vectorized import BulkSearcher, numpy
+from sdb.incremental import IncrementalSearcher
+
+WORDS = ['mail', 'bank', 'shop', 'news', 'cloud', 'git', 'chat', 'music', 'tax', 'work']
+TERMS = ['gh', 'bank', 'zz', 'mlcom', 'q']
+
+
+def make_records(n):
+    return [
+        ('%s%d.%s' % (random.choice(WORDS), i, random.choice(['com', 'org', 'net'])),
+         'user%d' % (i % 50), gen_password(length=20),
+         'some notes' if i % 3 else '')
+        for i in range(n)
+    ]
+
+
+def main(*sizes):
+    for n in sizes or (1000, 100000, 1000000):
+        records = make_records(n)
+        start = time.time()
+        index = SearchIndex(records)
+        print('%d records, index built in %.1f ms' % (n, (time.time() - start) * 1000))
+        bulk = None
+        if numpy is not None:
+            start = time.time()
+            bulk = BulkSearcher(records)
+            print('%d records, numpy matrices built in %.1f ms' % (n, (time.time() - start) * 1000))
+        for term in TERMS:
+            assert index.search(term) == search(term, records)
+            linear = min(timeit.repeat(lambda: search(term, records), number=1, repeat=3))
+            indexed = min(timeit.repeat(lambda: index.search(term), number=1, repeat=3))
+            assert search(term, records, limit=20) == search(term, records)[:20]
+            top = min(timeit.repeat(lambda: search(term, records, limit=20), number=1, repeat=3))
+            line = '  %-6s search() %9.1f ms   top 20 %9.1f ms   SearchIndex %9.1f ms' % (
+                term, linear * 1000, top * 1000, indexed * 1000)
+            if bulk is not None:
+                assert bulk.search(term) == search(term, records)
+                vectorized = min(timeit.repeat(lambda: bulk.search(term), number=1, repeat=3))
+                line += '   BulkSearcher %9.1f ms' % (vectorized * 1000)
+            print(line)
+
+        def retype():
+            for i in range(1, len(term) + 1):
+                search(term[:i], records, limit=20)
+
+        def incremental():
+            searcher = IncrementalSearcher(records)
+            for c in term:
+                searcher.append(c)
+                searcher.results(20)
+        for term in ['mail1', 'bank99.org']:
+            print('  typing %-10s search() %9.1f ms   IncrementalSearcher %9.1f ms' % (
+                term,
+                min(timeit.repeat(retype, number=1, repeat=3)) * 1000,
+                min(timeit.repeat(incremental, number=1, repeat=3)) * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,82 @@
+"""
+Settings for a vault, kept next to it in an INI file::
+
+    [encryption]
+    cipher = AES256
+    digest = SHA512
+    s2k_count = 3932160
+    compression = none
+
+`sdb tune` writes them.
+
+The vaults to use when --file isn't given can be listed in ~/.sdb.conf::
+
+    [vaults]
+    personal = ~/.passwords
+    team = ~/work/team-passwords
+"""
+import os
+
+try:
+    from ConfigParser import RawConfigParser
+except ImportError:
+    # PY3
+    from configparser import RawConfigParser
+
+
+# what encrypt() uses when there's no config
+ENCRYPTION_DEFAULTS = {
+    'cipher': 'AES',
+    'digest': 'SHA256',
+    's2k_count': 65011712,
+    'compression': 'zip',
+}
+
+
+def get_config_file(filename):
+    file_parts = os.path.split(filename)
+    return os.path.join(*file_parts[:-1] + ('.' + file_parts[-1].lstrip('.') + '.conf',))
+
+
+def read_encryption_settings(filename):
+    """
+    The encryption settings for the vault filename.
+    """
+    settings = dict(ENCRYPTION_DEFAULTS)
+    parser = RawConfigParser()
+    parser.read([get_config_file(filename)])
+    if parser.has_section('encryption'):
+        for name, value in parser.items('encryption'):
+            if name not in settings:
+                continue
+            if name == 's2k_count':
+                value = int(value)
+            settings[name] = value
+    return settings
+
+
+def write_encryption_settings(filename, settings):
+    parser = RawConfigParser()
+    config_file = get_config_file(filename)
+    parser.read([config_file])
+    if not parser.has_section('encryption'):
+        parser.add_section('encryption')
+    for name in sorted(settings):
+        parser.set('encryption', name, str(settings[name]))
+    with open(config_file, 'w') as f:
+        parser.write(f)
+
+
+def get_user_config_file():
+    return os.path.expanduser('~/.sdb.conf')
+
+
+def read_vaults(config_file=None):
+    """
+    The vaults listed in the user's config, as (name, filename) pairs.
+    """
+    parser = RawConfigParser()
+    parser.read([config_file or get_user_config_file()])
+    if not parser.has_section('vaults'):
+        return []
+    return [(name, os.path.expanduser(filename)) for name, filename in parser.items('vaults')]
@@ -0,0 +1,268 @@
+"""
+``sdb serve`` decrypts the password file once and keeps the records in memory,
+answering other sdb processes over a unix socket next to the password file.
+
+The protocol is one request per connection. The client sends a command line,
+optionally followed by a body, and shuts down its side of the socket. The
+daemon answers with ``OK`` or ``ERR <message>``, followed by the body, much
+like gpg-agent does.
+"""
+import os
+import stat
+import errno
+import socket
+import struct
+import hashlib
+
+from sdb.passwords import pack, decode, get_socket_file
+from sdb.index import SearchIndex
+from sdb.folding import FoldedRecord, fold
+
+
+class DaemonError(Exception):
+    pass
+
+
+class ConflictError(DaemonError):
+    """
+    Raised when a client tries to write records based on a stale read.
+    """
+    pass
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest().encode('ascii')
+
+
+def is_own_socket(socket_file):
+    """
+    Whether socket_file is a socket that only this user can use, as bind()
+    makes it. Anyone who can write to the directory could put another one
+    there, and the records would be sent to whoever is listening on it.
+    """
+    try:
+        st = os.lstat(socket_file)
+    except OSError:
+        return False
+    return (stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid() and
+            stat.S_IMODE(st.st_mode) == 0o600)
+
+
+def connect(filename):
+    """
+    Returns a DaemonClient if ``sdb serve`` is running for filename, or None.
+    """
+    socket_file = get_socket_file(filename)
+    if not is_own_socket(socket_file):
+        return None
+    client = DaemonClient(socket_file)
+    try:
+        client.request(b'PING')
+    except socket.error:
+        return None
+    return client
+
+
+class DaemonClient(object):
+    def __init__(self, socket_file):
+        self.socket_file = socket_file
+
+    def request(self, command, body=b''):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.socket_file)
+            self.check_peer(s)
+            s.sendall(command + b'\n' + body)
+            s.shutdown(socket.SHUT_WR)
+            f = s.makefile('rb')
+            try:
+                status = f.readline()
+                response = f.read()
+            finally:
+                f.close()
+        finally:
+            s.close()
+        if status.startswith(b'ERR conflict'):
+            raise ConflictError(status[4:].rstrip(b'\n').decode('utf-8'))
+        if status.startswith(b'ERR '):
+            raise DaemonError(status[4:].rstrip(b'\n').decode('utf-8'))
+        assert status == b'OK\n', "%r is not ok!" % status
+        return response
+
+    def check_peer(self, s):
+        """
+        Makes sure the daemon on the other end of s is run by this user, where
+        the system can say. The socket could have been replaced since connect()
+        looked at it.
+        """
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return
+        creds = s.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        pid, uid, gid = struct.unpack('3i', creds)
+        if uid != os.getuid():
+            raise DaemonError('%s is served by another user' % self.socket_file)
+
+    def read(self):
+        """
+        Returns all the records, in the on-disk format.
+        """
+        return self.request(b'READ')
+
+    def write(self, current, new):
+        """
+        Replaces the records with new, as long as nobody has changed them since
+        they were read as current.
+        """
+        self.request(b'WRITE ' + digest(current), new)
+
+    def search(self, term, limit=None):
+        """
+        Returns the records matching term, best first, in the on-disk format.
+        """
+        return self.request(('SEARCH %d' % (limit or 0)).encode('ascii'), term.encode('utf-8'))
+
+    def lock(self):
+        self.request(b'LOCK')
+
+
+class Daemon(object):
+    def __init__(self, session, timeout=600):
+        self.session = session
+        self.file = session.file
+        self.socket_file = get_socket_file(self.file)
+        self.timeout = timeout
+        self.records = None
+        self.stat = None
+        self.index = None
+
+    def load(self):
+        """
+        (Re)reads the records if the file has changed behind our back.
+        """
+        try:
+            stat = os.stat(self.file)
+            stat = (stat.st_ino, stat.st_size, stat.st_mtime)
+        except OSError:
+            stat = None
+        if self.records is None or stat != self.stat:
+            self.records = self.session.read_records()
+            self.index = None
+            self.stat = stat
+        return self.records
+
+    def search(self, term, limit=None):
+        records = self.load()
+        if self.index is None:
+            self.index = SearchIndex([FoldedRecord(record) for record in records])
+        return [folded.record for folded in self.index.search(fold(term)[0], limit)]
+
+    def lock(self):
+        """
+        Forget the records and the master password.
+        """
+        self.records = None
+        self.index = None
+        self.stat = None
+        self.session.password = None
+
+    def bind(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.socket_file):
+            # a stale socket from a daemon that didn't clean up after itself
+            try:
+                s.connect(self.socket_file)
+            except socket.error as e:
+                if e.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(self.socket_file)
+            else:
+                s.close()
+                raise DaemonError('sdb is already serving %s' % self.file)
+            s.close()
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # nobody else may connect, not even between bind and chmod
+        umask = os.umask(0o177)
+        try:
+            s.bind(self.socket_file)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_file, 0o600)
+        s.listen(5)
+        return s
+
+    def serve(self, listening_socket=None):
+        """
+        Answer requests until there haven't been any for timeout seconds, or
+        until someone asks us to lock.
+        """
+        s = listening_socket or self.bind()
+        s.settimeout(self.timeout)
+        try:
+            self.load()
+            while True:
+                try:
+                    conn, _ = s.accept()
+                except socket.timeout:
+                    break
+                try:
+                    conn.settimeout(30)
+                    if not self.handle(conn):
+                        break
+                except socket.error:
+                    # the client went away, that's its problem
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            s.close()
+            os.unlink(self.socket_file)
+            self.lock()
+
+    def handle(self, conn):
+        """
+        Answers one request. Returns False when the daemon should stop.
+        """
+        f = conn.makefile('rb')
+        try:
+            command = f.readline().rstrip(b'\n')
+            body = f.read()
+        finally:
+            f.close()
+        command, _, argument = command.partition(b' ')
+
+        try:
+            if command == b'PING':
+                response = b''
+            elif command == b'READ':
+                response = pack(self.load())
+            elif command == b'SEARCH':
+                response = pack(self.search(body.decode('utf-8'), int(argument or 0)))
+            elif command == b'WRITE':
+                self.write(argument, decode(body))
+                response = b''
+            elif command == b'LOCK':
+                conn.sendall(b'OK\n')
+                return False
+            elif not command:
+                # someone checking if we're alive
+                return True
+            else:
+                raise DaemonError('unknown command %r' % command)
+        except ConflictError as e:
+            conn.sendall(b'ERR conflict: ' + str(e).encode('utf-8') + b'\n')
+        except Exception as e:
+            conn.sendall(b'ERR ' + str(e).encode('utf-8').replace(b'\n', b' ') + b'\n')
+        else:
+            conn.sendall(b'OK\n' + response)
+        return True
+
+    def write(self, expected_digest, new_records):
+        def replace(records):
+            if digest(pack(records)) != expected_digest:
+                raise ConflictError('the records changed since they were read')
+            return new_records
+        self.session.edit_transaction(replace)
+        self.records = new_records
+        self.index = None
+        stat = os.stat(self.file)
+        self.stat = (stat.st_ino, stat.st_size, stat.st_mtime)
@@ -0,0 +1,89 @@
+"""
+Using several vaults at once, say for personal, team and infrastructure
+passwords. They're all decrypted at the same time, and searched together,
+and a change goes to the vault that has the record.
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+from sdb.passwords import VaultRecord, pretty_record
+
+
+def read_vault(session):
+    return session.read_records()
+
+
+class Federation(object):
+    def __init__(self, sessions):
+        self.sessions = sessions
+        # prompts and output go through the first one
+        self.primary = sessions[0]
+        self.args = self.primary.args
+        # a vault with the wrong password asks again from its thread, one at
+        # a time, so they don't read each other's answers
+        lock = threading.Lock()
+        for session in sessions:
+            session.password_lock = lock
+
+    def read_records(self):
+        """
+        The records of all the vaults, as VaultRecords, decrypting the vaults
+        in parallel.
+        """
+        pool = ThreadPool(len(self.sessions))
+        try:
+            results = pool.map(read_vault, self.sessions)
+        finally:
+            pool.close()
+            pool.join()
+        records = []
+        for session, session_records in zip(self.sessions, results):
+            records.extend(VaultRecord(record, session) for record in session_records)
+        return records
+
+    def choose_record(self):
+        query = self.args.domain or self.primary.prompt('Domain: ')
+        return self.primary.find_record(query, self.read_records())
+
+    def show_action(self, clipboard=10):
+        record = self.choose_record()
+        return record.vault.show_record(record, clipboard)
+
+    def add_action(self):
+        """
+        Adds the record to the first vault.
+        """
+        self.primary.add_action()
+
+    def edit_action(self):
+        record = self.choose_record()
+        new_record = record.vault.edit_record(record)
+        self.replace(record, [new_record])
+
+    def delete_action(self):
+        record = self.choose_record()
+        output = self.primary.output
+        output.write(pretty_record(record))
+        output.write('\n')
+        confirm = self.primary.prompt('Really? [n]: ', required=False) or 'n'
+        if confirm[0] == 'y':
+            self.replace(record, [])
+        else:
+            output.write("Ok, cancelled\n")
+
+    def replace(self, record, new_records):
+        """
+        Replaces record with new_records, in the vault that has it.
+        """
+        session = record.vault
+
+        def replace(records):
+            if record not in records:
+                raise Exception("The record changed in %s while it was being edited" % session.file)
+            i = records.index(record)
+            return records[:i] + [tuple(r) for r in new_records] + records[i + 1:]
+        session.edit_transaction(replace, domains=[record[0]] + [r[0] for r in new_records])
+
+    def raw_action(self):
+        for session in self.sessions:
+            session.raw_action()
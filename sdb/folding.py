@@ -0,0 +1,94 @@
+"""
+Folding text for matching regardless of case and accents: it's case folded,
+decomposed with NFKD, and the combining marks are dropped, so 'GitHub',
+'github' and 'gíthüb' all fold to 'github'.
+
+Folding is too slow to do to every record on every search, so FoldedRecord
+does it once, when the records are read, and keeps where each folded
+character came from, to find the matched characters in the original text.
+"""
+import unicodedata
+
+# the fields of a record that are folded: domain, username and notes
+FOLDED_FIELDS = (0, 1, 3)
+
+
+def is_ascii(text):
+    try:
+        return text.isascii()
+    except AttributeError:
+        # before Python 3.7
+        return all(ord(c) < 128 for c in text)
+
+
+def fold_char(c):
+    try:
+        c = c.casefold()
+    except AttributeError:
+        # PY2
+        c = c.lower()
+    return u''.join(d for d in unicodedata.normalize('NFKD', c) if not unicodedata.combining(d))
+
+
+def fold(text):
+    """
+    Returns (folded text, positions), where positions[i] is where in text the
+    i-th folded character came from, or None if it's the same place.
+    """
+    if not isinstance(text, type(u'')):
+        # bytes, which are matched as they are
+        return text, None
+    if is_ascii(text):
+        return text.lower(), None
+    pieces = []
+    positions = []
+    for i, c in enumerate(text):
+        folded = fold_char(c)
+        pieces.append(folded)
+        positions.extend([i] * len(folded))
+    if positions == list(range(len(text))):
+        positions = None
+    return u''.join(pieces), positions
+
+
+class FoldedRecord(tuple):
+    """
+    The folded domain, username and notes of record, in their places, for
+    searching like a record. record is the original, and positions are fold()'s
+    for each field.
+    """
+    def __new__(cls, record):
+        domain, username, notes = [fold(record[k]) for k in FOLDED_FIELDS]
+        self = super(FoldedRecord, cls).__new__(cls, (domain[0], username[0], u'', notes[0]))
+        self.record = record
+        self.positions = (domain[1], username[1], notes[1])
+        return self
+
+
+def match_positions(needle, folded):
+    """
+    Where the characters of needle, which is already folded, match the
+    FoldedRecord folded, as (field, position in the original field) pairs,
+    the way match() matches them. Returns [] if they don't.
+    """
+    result = []
+    fields = [folded[k] for k in FOLDED_FIELDS]
+    k = 0
+    j = 0
+    for c in needle:
+        while k < len(fields):
+            try:
+                j = fields[k].find(c, j)
+            except TypeError:
+                # text in bytes
+                return []
+            if j != -1:
+                break
+            k += 1
+            j = 0
+        if k == len(fields):
+            return []
+        positions = folded.positions[k]
+        result.append((FOLDED_FIELDS[k], positions[j] if positions else j))
+        j += 1
+    return result
@@ -0,0 +1,74 @@
+"""
+Searching as the term is typed a character at a time.
+
+match() is a subsequence match, so a record that doesn't match a term can't
+match anything that starts with it, and a record that does is matched by
+finding the term's new last character after where the rest of it matched.
+IncrementalSearcher keeps, for every prefix of the term, the records that
+match it and where the match got to, so adding a character only looks at the
+records that matched without it, from where they left off, and taking one
+away just goes back to the previous prefix.
+"""
+import heapq
+from operator import itemgetter
+
+from sdb.index import haystack
+
+
+class IncrementalSearcher(object):
+    def __init__(self, records):
+        self.records = list(records)
+        self.haystacks = [haystack(record) for record in self.records]
+        self.term = ''
+        # For each prefix of the term, the records that match it, in order,
+        # as (id, score, last_match, where to look next), just like match()
+        # would have them after that prefix.
+        self.states = [[(i, 1, 0, 0) for i in range(len(self.records))]]
+
+    def append(self, c):
+        haystacks = self.haystacks
+        matches = []
+        for i, score, last_match, j in self.states[-1]:
+            try:
+                j = haystacks[i].find(c, j)
+            except TypeError:
+                # text in bytes
+                continue
+            if j != -1:
+                matches.append((i, score + 1 / (last_match + 1.), j, j + 1))
+        self.states.append(matches)
+        self.term += c
+
+    def backspace(self):
+        if self.term:
+            self.states.pop()
+            self.term = self.term[:-1]
+
+    def set_term(self, term):
+        """
+        Changes the term to term, reusing as much of the last one as possible.
+        """
+        common = 0
+        for a, b in zip(self.term, term):
+            if a != b:
+                break
+            common += 1
+        while len(self.term) > common:
+            self.backspace()
+        for c in term[common:]:
+            self.append(c)
+
+    def __len__(self):
+        return len(self.states[-1])
+
+    def results(self, limit=None):
+        """
+        The records that match the term, best first: the same as
+        search(term, records, limit).
+        """
+        matches = self.states[-1]
+        if limit:
+            best = heapq.nlargest(limit, matches, key=itemgetter(1))
+        else:
+            best = sorted(matches, key=itemgetter(1), reverse=True)
+        return [self.records[m[0]] for m in best]
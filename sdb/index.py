@@ -0,0 +1,80 @@
+"""
+An index for searching the same records over and over, like ``sdb serve``
+does.
+
+search() scores every record with match(), a character at a time. A record
+can only match if it has every character of the term somewhere, so the index
+keeps, for each character, a bitmap of the records that have it. A search ANDs
+together the bitmaps for the characters of the term, and only scores the
+records that are left. The results are exactly the same as search()'s.
+"""
+import binascii
+
+from sdb.passwords import search, SEARCHED_FIELDS
+
+
+def haystack(record):
+    """
+    What record_score matches against: the searched fields, joined together.
+    If some of them are bytes and some text, only the ones before the first
+    of the other kind, since record_score stops there too.
+    """
+    text = record[SEARCHED_FIELDS[0]]
+    for i in SEARCHED_FIELDS[1:]:
+        try:
+            text = text + record[i]
+        except TypeError:
+            break
+    return text
+
+
+def iter_bits(bitmap):
+    """
+    The positions of the set bits of the int bitmap, smallest first.
+    """
+    bits = bin(bitmap)[:1:-1]
+    i = bits.find('1')
+    while i != -1:
+        yield i
+        i = bits.find('1', i + 1)
+
+
+class SearchIndex(object):
+    def __init__(self, records):
+        self.records = list(records)
+        size = (len(self.records) + 7) // 8
+        bitmaps = {}
+        for i, record in enumerate(self.records):
+            text = haystack(record)
+            byte, bit = size - 1 - (i >> 3), 1 << (i & 7)
+            for c in set(text):
+                try:
+                    bitmap = bitmaps[c]
+                except KeyError:
+                    bitmap = bitmaps[c] = bytearray(size)
+                bitmap[byte] |= bit
+        # as ints, which can be ANDed quickly. Record i is bit i.
+        self.bitmaps = dict(
+            (c, int(binascii.hexlify(bitmap), 16))
+            for c, bitmap in bitmaps.items()
+        )
+        self.everything = (1 << len(self.records)) - 1
+
+    def candidates(self, term):
+        """
+        The ids of the records that have every character in term, in order.
+        """
+        bitmap = self.everything
+        for c in set(term):
+            bitmap &= self.bitmaps.get(c, 0)
+            if not bitmap:
+                return []
+        return iter_bits(bitmap)
+
+    def search(self, term, limit=None):
+        """
+        The same as search(term, records, limit), for the records the index
+        was built from.
+        """
+        records = self.records
+        return search(term, (records[i] for i in self.candidates(term)), limit)
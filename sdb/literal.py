@@ -0,0 +1,117 @@
+"""
+A parser for the one kind of literal sdb writes: a tuple of strings, as
+produced by repr(). It is much faster than ast.literal_eval, which builds a
+whole syntax tree for every line. Anything it doesn't recognize is handed to
+ast.literal_eval, so the results are always the same.
+"""
+import re
+import ast
+
+try:
+    unichr
+except NameError:
+    # PY3
+    unichr = chr
+
+# In python 2, a string literal without a prefix is a byte string.
+NATIVE_BYTES = str is bytes
+
+_LITERAL = re.compile(r"""
+    ([bBuU]?)                                   # prefix
+    (?:'([^'\\]*(?:\\.[^'\\]*)*)'               # single quoted body
+      |"([^"\\]*(?:\\.[^"\\]*)*)")              # double quoted body
+    (,\ |,?\)\Z)                                # next item, or the end
+""", re.VERBOSE | re.DOTALL)
+
+# The usual case: a whole record of strings without any escapes.
+_SIMPLE_RECORD = re.compile(r"\('([^'\\]*)', '([^'\\]*)', '([^'\\]*)', '([^'\\]*)'\)\Z")
+
+_ESCAPE = re.compile(r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)', re.DOTALL)
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+_SIMPLE_ESCAPES = {
+    '\\': '\\',
+    "'": "'",
+    '"': '"',
+    'a': '\a',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+}
+
+
+class UnsupportedLiteral(ValueError):
+    pass
+
+
+def _unescape_text(match):
+    escape = match.group(1)
+    if escape[0] in 'xuU':
+        return unichr(int(escape[1:], 16))
+    try:
+        return _SIMPLE_ESCAPES[escape]
+    except KeyError:
+        # octal escapes, \N{...}, and invalid escapes
+        raise UnsupportedLiteral(escape)
+
+
+def _unescape_bytes(match):
+    escape = match.group(1)
+    if escape[0] in 'uU':
+        # not an escape in a bytes literal
+        raise UnsupportedLiteral(escape)
+    return _unescape_text(match)
+
+
+def parse_tuple(line):
+    """
+    Parses a tuple of string literals, raising UnsupportedLiteral if line is
+    anything else.
+    """
+    if not NATIVE_BYTES:
+        m = _SIMPLE_RECORD.match(line)
+        if m is not None:
+            return m.groups()
+    if not line.startswith('('):
+        raise UnsupportedLiteral(line)
+    match = _LITERAL.match
+    fields = []
+    pos = 1
+    while True:
+        m = match(line, pos)
+        if m is None:
+            raise UnsupportedLiteral(line)
+        prefix, body, double_quoted_body, separator = m.groups()
+        if body is None:
+            body = double_quoted_body
+        if prefix in ('b', 'B') or (NATIVE_BYTES and prefix == ''):
+            if _NON_ASCII.search(body):
+                # not allowed in a bytes literal
+                raise UnsupportedLiteral(line)
+            if '\\' in body:
+                body = _ESCAPE.sub(_unescape_bytes, body)
+            body = body.encode('latin-1')
+        elif '\\' in body:
+            body = _ESCAPE.sub(_unescape_text, body)
+        fields.append(body)
+        pos = m.end()
+        if separator != ', ':
+            break
+    if len(fields) == 1 and separator == ')':
+        # ('a') is a string in parentheses, not a tuple
+        raise UnsupportedLiteral(line)
+    return tuple(fields)
+
+
+def literal_eval(line):
+    """
+    Equivalent to ast.literal_eval(line), but fast for tuples of strings.
+    """
+    try:
+        return parse_tuple(line)
+    except (UnsupportedLiteral, UnicodeError, ValueError):
+        return ast.literal_eval(line)
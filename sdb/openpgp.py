@@ -0,0 +1,561 @@
+"""
+Symmetric OpenPGP encryption (RFC 4880), enough to read and write the same
+files as ``gpg -c``: a symmetric-key encrypted session key packet using an
+iterated and salted S2K, followed by a symmetrically encrypted and integrity
+protected data packet holding a (compressed) literal data packet, optionally
+ASCII armored.
+
+AES comes from the ``cryptography`` package if it's installed, and from a
+slow pure-python implementation otherwise. Anything gpg can write that isn't
+implemented here raises Unsupported.
+"""
+import os
+import bz2
+import zlib
+import time
+import base64
+import struct
+import hashlib
+import binascii
+
+try:
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+# whether AES is done by cryptography, rather than in pure python
+FAST = Cipher is not None
+
+
+class OpenPGPError(Exception):
+    pass
+
+
+class BadPassphrase(OpenPGPError):
+    pass
+
+
+class CorruptData(OpenPGPError):
+    pass
+
+
+class NoData(OpenPGPError):
+    pass
+
+
+class Unsupported(OpenPGPError):
+    pass
+
+
+# algorithm id: key size
+CIPHER_KEY_SIZES = {7: 16, 8: 24, 9: 32}
+CIPHERS = {'AES': 7, 'AES128': 7, 'AES192': 8, 'AES256': 9}
+# algorithm id: hashlib name
+HASH_NAMES = {1: 'md5', 2: 'sha1', 3: 'ripemd160', 8: 'sha256', 9: 'sha384', 10: 'sha512', 11: 'sha224'}
+HASHES = {'SHA1': 2, 'SHA256': 8, 'SHA384': 9, 'SHA512': 10, 'SHA224': 11}
+COMPRESSIONS = {'none': 0, 'zip': 1, 'zlib': 2, 'bzip2': 3}
+
+DEFAULT_S2K_COUNT = 65011712
+BLOCK_SIZE = 16
+
+ARMOR_BEGIN = b'-----BEGIN PGP MESSAGE-----'
+ARMOR_END = b'-----END PGP MESSAGE-----'
+
+
+def octets(*values):
+    return bytes(bytearray(values))
+
+
+# AES, for when cryptography isn't available. Only the forward cipher is
+# needed, CFB mode uses it for decryption too.
+
+def _make_aes_tables():
+    def xtime(a):
+        a <<= 1
+        return a ^ 0x11b if a & 0x100 else a
+
+    def rotl8(x, shift):
+        return ((x << shift) | (x >> (8 - shift))) & 0xff
+
+    # multiplicative inverses in GF(2^8), from logarithms base 3
+    exp = [0] * 255
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x ^= xtime(x)
+    sbox = [0x63] * 256
+    for a in range(1, 256):
+        inverse = exp[-log[a] % 255]
+        sbox[a] = inverse ^ rotl8(inverse, 1) ^ rotl8(inverse, 2) ^ rotl8(inverse, 3) ^ rotl8(inverse, 4) ^ 0x63
+
+    t0 = []
+    for s in sbox:
+        s2 = xtime(s)
+        t0.append((s2 << 24) | (s << 16) | (s << 8) | (s2 ^ s))
+    t1 = [(t >> 8) | ((t & 0xff) << 24) for t in t0]
+    t2 = [(t >> 8) | ((t & 0xff) << 24) for t in t1]
+    t3 = [(t >> 8) | ((t & 0xff) << 24) for t in t2]
+    return sbox, t0, t1, t2, t3
+
+
+_AES_TABLES = None
+
+
+class PurePythonAES(object):
+    def __init__(self, key):
+        global _AES_TABLES
+        if _AES_TABLES is None:
+            _AES_TABLES = _make_aes_tables()
+        self.sbox, self.t0, self.t1, self.t2, self.t3 = _AES_TABLES
+        sbox = self.sbox
+
+        nk = len(key) // 4
+        self.rounds = nk + 6
+        words = list(struct.unpack('>%dI' % nk, key))
+        rcon = 1
+        for i in range(nk, 4 * (self.rounds + 1)):
+            t = words[i - 1]
+            if i % nk == 0:
+                t = ((t << 8) & 0xffffffff) | (t >> 24)
+                t = ((sbox[t >> 24] << 24) | (sbox[(t >> 16) & 0xff] << 16) |
+                     (sbox[(t >> 8) & 0xff] << 8) | sbox[t & 0xff])
+                t ^= rcon << 24
+                rcon <<= 1
+                if rcon & 0x100:
+                    rcon ^= 0x11b
+            elif nk > 6 and i % nk == 4:
+                t = ((sbox[t >> 24] << 24) | (sbox[(t >> 16) & 0xff] << 16) |
+                     (sbox[(t >> 8) & 0xff] << 8) | sbox[t & 0xff])
+            words.append(words[i - nk] ^ t)
+        self.round_keys = words
+
+    def encrypt_block(self, s0, s1, s2, s3):
+        """
+        Encrypts a block given as four big-endian 32 bit words.
+        """
+        rk = self.round_keys
+        t0, t1, t2, t3, sbox = self.t0, self.t1, self.t2, self.t3, self.sbox
+        s0 ^= rk[0]
+        s1 ^= rk[1]
+        s2 ^= rk[2]
+        s3 ^= rk[3]
+        k = 4
+        for r in range(self.rounds - 1):
+            s0, s1, s2, s3 = (
+                t0[s0 >> 24] ^ t1[(s1 >> 16) & 0xff] ^ t2[(s2 >> 8) & 0xff] ^ t3[s3 & 0xff] ^ rk[k],
+                t0[s1 >> 24] ^ t1[(s2 >> 16) & 0xff] ^ t2[(s3 >> 8) & 0xff] ^ t3[s0 & 0xff] ^ rk[k + 1],
+                t0[s2 >> 24] ^ t1[(s3 >> 16) & 0xff] ^ t2[(s0 >> 8) & 0xff] ^ t3[s1 & 0xff] ^ rk[k + 2],
+                t0[s3 >> 24] ^ t1[(s0 >> 16) & 0xff] ^ t2[(s1 >> 8) & 0xff] ^ t3[s2 & 0xff] ^ rk[k + 3],
+            )
+            k += 4
+        return (
+            ((sbox[s0 >> 24] << 24) | (sbox[(s1 >> 16) & 0xff] << 16) |
+             (sbox[(s2 >> 8) & 0xff] << 8) | sbox[s3 & 0xff]) ^ rk[k],
+            ((sbox[s1 >> 24] << 24) | (sbox[(s2 >> 16) & 0xff] << 16) |
+             (sbox[(s3 >> 8) & 0xff] << 8) | sbox[s0 & 0xff]) ^ rk[k + 1],
+            ((sbox[s2 >> 24] << 24) | (sbox[(s3 >> 16) & 0xff] << 16) |
+             (sbox[(s0 >> 8) & 0xff] << 8) | sbox[s1 & 0xff]) ^ rk[k + 2],
+            ((sbox[s3 >> 24] << 24) | (sbox[(s0 >> 16) & 0xff] << 16) |
+             (sbox[(s1 >> 8) & 0xff] << 8) | sbox[s2 & 0xff]) ^ rk[k + 3],
+        )
+
+    def cfb(self, data, decrypt):
+        """
+        CFB mode with an all zero IV, as used for OpenPGP's integrity
+        protected data.
+        """
+        padding = -len(data) % BLOCK_SIZE
+        words = struct.unpack('>%dI' % ((len(data) + padding) // 4), data + b'\0' * padding)
+        out = []
+        feedback = (0, 0, 0, 0)
+        encrypt_block = self.encrypt_block
+        for i in range(0, len(words), 4):
+            k0, k1, k2, k3 = encrypt_block(*feedback)
+            block = words[i:i + 4]
+            result = (block[0] ^ k0, block[1] ^ k1, block[2] ^ k2, block[3] ^ k3)
+            out.extend(result)
+            feedback = block if decrypt else result
+        return struct.pack('>%dI' % len(out), *out)[:len(data)]
+
+
+def cfb_encrypt(key, data):
+    if Cipher is None:
+        return PurePythonAES(key).cfb(data, decrypt=False)
+    encryptor = Cipher(algorithms.AES(key), modes.CFB(b'\0' * BLOCK_SIZE), default_backend()).encryptor()
+    return encryptor.update(data) + encryptor.finalize()
+
+
+def cfb_decrypt(key, data):
+    if Cipher is None:
+        return PurePythonAES(key).cfb(data, decrypt=True)
+    decryptor = Cipher(algorithms.AES(key), modes.CFB(b'\0' * BLOCK_SIZE), default_backend()).decryptor()
+    return decryptor.update(data) + decryptor.finalize()
+
+
+def decode_s2k_count(c):
+    return (16 + (c & 15)) << ((c >> 4) + 6)
+
+
+def encode_s2k_count(count):
+    """
+    The smallest coded count that is at least count.
+    """
+    for c in range(256):
+        if decode_s2k_count(c) >= count:
+            return c
+    return 255
+
+
+def s2k(password, hash_algo, salt, count, key_size):
+    """
+    Derives a key from password with the iterated and salted S2K. For the
+    simple and salted S2Ks, pass count=0.
+    """
+    try:
+        hash_name = HASH_NAMES[hash_algo]
+    except KeyError:
+        raise Unsupported('hash algorithm %d' % hash_algo)
+    data = salt + password
+    count = max(count, len(data))
+    # hash the repeated data a big chunk at a time
+    chunk = data * max(1, 65536 // len(data)) if data else b''
+    key = b''
+    preload = 0
+    while len(key) < key_size:
+        h = hashlib.new(hash_name)
+        h.update(b'\0' * preload)
+        if chunk:
+            for i in range(count // len(chunk)):
+                h.update(chunk)
+            h.update(chunk[:count % len(chunk)])
+        key += h.digest()
+        preload += 1
+    return key[:key_size]
+
+
+def crc24(data):
+    crc = 0xb704ce
+    table = _crc24_table()
+    for octet in bytearray(data):
+        crc = ((crc << 8) & 0xffffff) ^ table[(crc >> 16) ^ octet]
+    return crc
+
+
+_CRC24_TABLE = []
+
+
+def _crc24_table():
+    if not _CRC24_TABLE:
+        for i in range(256):
+            crc = i << 16
+            for j in range(8):
+                crc <<= 1
+                if crc & 0x1000000:
+                    crc ^= 0x1864cfb
+            _CRC24_TABLE.append(crc & 0xffffff)
+    return _CRC24_TABLE
+
+
+def armor(data):
+    b64 = base64.b64encode(data)
+    lines = [ARMOR_BEGIN, b'']
+    lines.extend(b64[i:i + 64] for i in range(0, len(b64), 64))
+    lines.append(b'=' + base64.b64encode(struct.pack('>I', crc24(data))[1:]))
+    lines.append(ARMOR_END)
+    return b'\n'.join(lines) + b'\n'
+
+
+def is_armored(data):
+    return data.lstrip()[:len(ARMOR_BEGIN)] == ARMOR_BEGIN
+
+
+def dearmor(data):
+    lines = [line.strip() for line in data.lstrip().splitlines()]
+    try:
+        # skip the header lines
+        start = lines.index(b'', 1) + 1
+        end = lines.index(ARMOR_END, start)
+    except ValueError:
+        raise CorruptData('invalid armor')
+    body = lines[start:end]
+    checksum = None
+    if body and body[-1].startswith(b'='):
+        checksum = body.pop()[1:]
+    try:
+        binary = base64.b64decode(b''.join(body))
+        if checksum is not None:
+            checksum, = struct.unpack('>I', b'\0' + base64.b64decode(checksum))
+    except (binascii.Error, TypeError, struct.error):
+        raise CorruptData('invalid armor')
+    if checksum is not None and checksum != crc24(binary):
+        raise CorruptData('CRC error')
+    return binary
+
+
+def new_packet(tag, body):
+    length = len(body)
+    if length < 192:
+        header = octets(0xc0 | tag, length)
+    elif length < 8384:
+        length -= 192
+        header = octets(0xc0 | tag, (length >> 8) + 192, length & 0xff)
+    else:
+        header = octets(0xc0 | tag, 255) + struct.pack('>I', length)
+    return header + body
+
+
+def read_packets(data):
+    """
+    Yields the tag and body of each packet in data.
+    """
+    data = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        ctb = bytearray(data[pos:pos + 1].tobytes())[0]
+        if not ctb & 0x80:
+            raise CorruptData('invalid packet')
+        pos += 1
+        if ctb & 0x40:
+            tag = ctb & 0x3f
+            chunks = []
+            while True:
+                header = bytearray(data[pos:pos + 5].tobytes())
+                if not header:
+                    raise CorruptData('invalid packet')
+                if header[0] < 192:
+                    length, pos = header[0], pos + 1
+                elif header[0] < 224:
+                    if len(header) < 2:
+                        raise CorruptData('invalid packet')
+                    length, pos = ((header[0] - 192) << 8) + header[1] + 192, pos + 2
+                elif header[0] == 255:
+                    if len(header) < 5:
+                        raise CorruptData('invalid packet')
+                    length, = struct.unpack('>I', bytes(header[1:5]))
+                    pos += 5
+                else:
+                    # a partial body length, more chunks follow
+                    length = 1 << (header[0] & 0x1f)
+                    chunks.append(data[pos + 1:pos + 1 + length].tobytes())
+                    pos += 1 + length
+                    continue
+                chunks.append(data[pos:pos + length].tobytes())
+                pos += length
+                break
+            body = b''.join(chunks)
+        else:
+            tag = (ctb >> 2) & 0xf
+            length_type = ctb & 3
+            if length_type == 3:
+                # indeterminate, to the end of the data
+                length = len(data) - pos
+            else:
+                size = (1, 2, 4)[length_type]
+                header = data[pos:pos + size].tobytes()
+                if len(header) < size:
+                    raise CorruptData('invalid packet')
+                length, = struct.unpack(('>B', '>H', '>I')[length_type], header)
+                pos += size
+            body = data[pos:pos + length].tobytes()
+            pos += length
+        if pos > len(data):
+            raise CorruptData('invalid packet')
+        yield tag, body
+
+
+def read_literal(data):
+    """
+    Returns the contents of the literal data packet in data, decompressing it
+    if necessary.
+    """
+    for tag, body in read_packets(data):
+        if tag == 11:
+            name_length = bytearray(body[1:2])[0]
+            return body[2 + name_length + 4:]
+        elif tag == 8:
+            algo = bytearray(body[:1])[0]
+            try:
+                if algo == 0:
+                    inner = body[1:]
+                elif algo == 1:
+                    decompressor = zlib.decompressobj(-15)
+                    inner = decompressor.decompress(body[1:]) + decompressor.flush()
+                elif algo == 2:
+                    inner = zlib.decompress(body[1:])
+                elif algo == 3:
+                    inner = bz2.decompress(body[1:])
+                else:
+                    raise Unsupported('compression algorithm %d' % algo)
+            except (zlib.error, IOError, ValueError, EOFError) as e:
+                raise CorruptData('decompression failed: %s' % e)
+            return read_literal(inner)
+        elif tag in (2, 4, 10):
+            # signatures and markers
+            continue
+        else:
+            raise CorruptData('unexpected packet %d' % tag)
+    raise CorruptData('no literal data')
+
+
+def session_keys(password, body):
+    """
+    Yields the possible session keys from a symmetric-key encrypted session
+    key packet.
+    """
+    body = bytearray(body)
+    if len(body) < 4:
+        raise CorruptData('invalid packet')
+    if body[0] != 4:
+        raise Unsupported('symmetric key packet version %d' % body[0])
+    cipher_algo, s2k_type, hash_algo = body[1], body[2], body[3]
+    if cipher_algo not in CIPHER_KEY_SIZES:
+        raise Unsupported('cipher algorithm %d' % cipher_algo)
+    if s2k_type == 0:
+        salt, count, rest = b'', 0, body[4:]
+    elif s2k_type == 1:
+        salt, count, rest = bytes(body[4:12]), 0, body[12:]
+    elif s2k_type == 3:
+        salt, count, rest = bytes(body[4:12]), decode_s2k_count(body[12]), body[13:]
+    else:
+        raise Unsupported('S2K type %d' % s2k_type)
+    key = s2k(password, hash_algo, salt, count, CIPHER_KEY_SIZES[cipher_algo])
+    if not rest:
+        return key
+    session_key = bytearray(cfb_decrypt(key, bytes(rest)))
+    if session_key[0] not in CIPHER_KEY_SIZES or len(session_key) - 1 != CIPHER_KEY_SIZES[session_key[0]]:
+        raise BadPassphrase('decryption failed: bad key')
+    return bytes(session_key[1:])
+
+
+def decrypt(password, data):
+    if is_armored(data):
+        data = dearmor(data)
+    if not data or not bytearray(data[:1])[0] & 0x80:
+        raise NoData('no valid OpenPGP data found')
+
+    key_packets = []
+    encrypted = None
+    for tag, body in read_packets(data):
+        if tag == 3:
+            key_packets.append(body)
+        elif tag == 18:
+            encrypted = body
+            break
+        elif tag == 10:
+            continue
+        else:
+            raise Unsupported('packet type %d' % tag)
+    if not key_packets or encrypted is None:
+        raise NoData('no valid OpenPGP data found')
+
+    for key_packet in key_packets:
+        try:
+            return decrypt_data(session_keys(password, key_packet), encrypted)
+        except BadPassphrase:
+            continue
+    raise BadPassphrase('decryption failed: bad key')
+
+
+def decrypt_data(key, encrypted):
+    """
+    Decrypts the body of a symmetrically encrypted integrity protected data
+    packet with the session key, returning the literal data.
+    """
+    if encrypted[:1] != b'\x01':
+        raise Unsupported('encrypted data packet version')
+    plaintext = cfb_decrypt(key, encrypted[1:])
+    # the random prefix repeats its last two octets, to check the key
+    if plaintext[BLOCK_SIZE - 2:BLOCK_SIZE] != plaintext[BLOCK_SIZE:BLOCK_SIZE + 2]:
+        raise BadPassphrase('decryption failed: bad key')
+    mdc = plaintext[-22:]
+    if mdc[:2] != b'\xd3\x14' or hashlib.sha1(plaintext[:-20]).digest() != mdc[2:]:
+        raise CorruptData('decryption failed: invalid packet')
+    return read_literal(plaintext[BLOCK_SIZE + 2:-22])
+
+
+def new_key_packet(password, cipher='AES', digest='SHA256', s2k_count=DEFAULT_S2K_COUNT):
+    """
+    Returns a symmetric-key encrypted session key packet with a new salt, and
+    the key derived from password with it. The packet doesn't hold an
+    encrypted session key, so that key is the one the data is encrypted with.
+    """
+    cipher_algo = CIPHERS[cipher]
+    hash_algo = HASHES[digest]
+    count = encode_s2k_count(s2k_count)
+    salt = os.urandom(8)
+    key = s2k(password, hash_algo, salt, decode_s2k_count(count), CIPHER_KEY_SIZES[cipher_algo])
+    return new_packet(3, octets(4, cipher_algo, 3, hash_algo) + salt + octets(count)), key
+
+
+def read_key_packet(password, data):
+    """
+    The session key from the symmetric-key encrypted session key packet in
+    data, like new_key_packet() returns.
+    """
+    for tag, body in read_packets(data):
+        if tag == 3:
+            return session_keys(password, body)
+    raise NoData('no valid OpenPGP data found')
+
+
+def encrypt_data(key, data, compression='zip'):
+    """
+    The symmetrically encrypted integrity protected data packet holding data,
+    encrypted with the session key. After a session key packet for key, it's
+    a message anything can decrypt.
+    """
+    packets = new_packet(11, b'b\0' + struct.pack('>I', int(time.time())) + data)
+    algo = COMPRESSIONS[compression]
+    if algo == 1:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        packets = new_packet(8, octets(algo) + compressor.compress(packets) + compressor.flush())
+    elif algo == 2:
+        packets = new_packet(8, octets(algo) + zlib.compress(packets))
+    elif algo == 3:
+        packets = new_packet(8, octets(algo) + bz2.compress(packets))
+
+    prefix = os.urandom(BLOCK_SIZE)
+    prefix += prefix[-2:]
+    plaintext = prefix + packets + b'\xd3\x14'
+    plaintext += hashlib.sha1(plaintext).digest()
+    return new_packet(18, b'\x01' + cfb_encrypt(key, plaintext))
+
+
+def decrypt_packet(key, data):
+    """
+    Decrypts the encrypted data packet in the binary message data with the
+    session key.
+    """
+    for tag, body in read_packets(data):
+        if tag == 18:
+            return decrypt_data(key, body)
+    raise NoData('no valid OpenPGP data found')
+
+
+def encrypt(password, data, cipher='AES', digest='SHA256', s2k_count=DEFAULT_S2K_COUNT,
+            compression='zip', armored=True):
+    key_packet, key = new_key_packet(password, cipher, digest, s2k_count)
+    message = key_packet + encrypt_data(key, data, compression)
+    if armored:
+        return armor(message)
+    return message
+
+
+def encrypt_digest(password, data, cipher='AES', digest='SHA256', s2k_count=DEFAULT_S2K_COUNT,
+                   compression='zip', armored=True):
+    """
+    Like encrypt(), but also returns the sha256 digest of what the result
+    decrypts to. It's decrypted with the session key it was encrypted with,
+    so the S2K isn't done again.
+    """
+    key_packet, key = new_key_packet(password, cipher, digest, s2k_count)
+    message = key_packet + encrypt_data(key, data, compression)
+    if armored:
+        result = armor(message)
+        message = dearmor(result)
+    else:
+        result = message
+    return result, hashlib.sha256(decrypt_packet(key, message)).digest()
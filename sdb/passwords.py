@@ -1,22 +1,33 @@
+import io
 import os
-import ast
 import sys
 import math
 import time
+import shutil
+import struct
 import string
+import heapq
 import hashlib
+import binascii
+import itertools
 import tempfile
+import threading
 import subprocess
 from operator import itemgetter
 from contextlib import contextmanager
 from getpass import getpass
-import random; random = random.SystemRandom()
 
 import sdb.subprocess_compat as subprocess
 from sdb.util import force_bytes
+from sdb.literal import literal_eval
 from sdb.clipboard import set_clipboard_once, ClipboardException
-from sdb.diceware import WORDS
-from sdb import gpg_agent
+from sdb.diceware import WORDS, load_word_list
+from sdb.randomness import source
+from sdb.shards import SHARDS_MAGIC, Manifest, remove_unused_segments
+from sdb import gpg_agent, openpgp
+from sdb.folding import FoldedRecord, fold
+from sdb.config import ENCRYPTION_DEFAULTS, read_encryption_settings, write_encryption_settings
+from sdb.tune import tune
 
 
 def encode(records):
@@ -26,12 +37,231 @@ def encode(records):
     return ('\n'.join(res) + '\n').encode('utf-8')
 
 
-def decode(str):
-    records = []
-    for line in str.decode('utf-8').split('\n'):
+# The packed format is PACKED_MAGIC followed by the records. Each record is
+# the number of fields, then a type (b't' for text, b'b' for bytes) and a
+# length for each field, then the fields themselves, with no escaping.
+PACKED_MAGIC = b'\x00sdb2\n'
+RECORD_HEADER = struct.Struct('>H')
+
+
+def pack(records):
+    res = [PACKED_MAGIC]
+    for record in records:
+        header = [len(record)]
+        fields = []
+        for field in record:
+            if isinstance(field, bytes):
+                header.append(b'b')
+            else:
+                header.append(b't')
+                field = field.encode('utf-8')
+            header.append(len(field))
+            fields.append(field)
+        res.append(struct.pack('>H' + 'cI' * len(record), *header))
+        res.extend(fields)
+    return b''.join(res)
+
+
+def iter_unpack(f):
+    """
+    Yields the records from a file-like object positioned just after
+    PACKED_MAGIC.
+    """
+    field_headers = {}
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if not header:
+            return
+        if len(header) != RECORD_HEADER.size:
+            raise ValueError('truncated record')
+        count, = RECORD_HEADER.unpack(header)
+        try:
+            field_header = field_headers[count]
+        except KeyError:
+            field_header = field_headers[count] = struct.Struct('>' + 'cI' * count)
+        header = f.read(field_header.size)
+        if len(header) != field_header.size:
+            raise ValueError('truncated record')
+        header = field_header.unpack(header)
+        body = f.read(sum(header[1::2]))
+        record = []
+        start = 0
+        for i in range(0, len(header), 2):
+            end = start + header[i + 1]
+            if header[i] == b't':
+                record.append(body[start:end].decode('utf-8'))
+            else:
+                record.append(body[start:end])
+            start = end
+        if start != len(body):
+            raise ValueError('truncated record')
+        yield tuple(record)
+
+
+def iter_lines(f):
+    for line in f:
+        line = line.rstrip(b'\n')
         if line:
-            records.append(ast.literal_eval(line))
-    return records
+            yield literal_eval(line.decode('utf-8'))
+
+
+# The columnar format is COLUMNS_MAGIC followed by the number of records and
+# of distinct usernames, the usernames, a username number for each record,
+# then the domains, the notes and the passwords. Each column of strings is the
+# length of each string followed by the strings.
+COLUMNS_MAGIC = b'\x00sdb3\n'
+COLUMNS_HEADER = struct.Struct('>II')
+
+
+def pack_strings(strings):
+    strings = [i.encode('utf-8') for i in strings]
+    lengths = struct.pack('>%dI' % len(strings), *map(len, strings))
+    return lengths + b''.join(strings)
+
+
+def unpack_from(format, data, offset):
+    """
+    struct.unpack_from(), but a ValueError if data is too short.
+    """
+    if len(data) < offset + struct.calcsize(format):
+        raise ValueError('truncated columns')
+    return struct.unpack_from(format, data, offset)
+
+
+def unpack_strings(data, offset, count):
+    """
+    Returns the count strings at offset in data, and the offset after them.
+    """
+    lengths = unpack_from('>%dI' % count, data, offset)
+    offset += 4 * count
+    strings = []
+    for length in lengths:
+        strings.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    return strings, offset
+
+
+def pack_columns(records):
+    """
+    Encodes records of four text fields a column at a time, so the domains,
+    usernames and notes can be read without decoding any passwords.
+    """
+    usernames = {}
+    username_ids = []
+    for record in records:
+        if len(record) != 4 or not all(isinstance(i, type(u'')) for i in record):
+            raise ValueError("Only records of four text fields can be stored in columns")
+        username_ids.append(usernames.setdefault(record[1], len(usernames)))
+    usernames = sorted(usernames, key=usernames.get)
+    return b''.join([
+        COLUMNS_MAGIC,
+        COLUMNS_HEADER.pack(len(records), len(usernames)),
+        pack_strings(usernames),
+        struct.pack('>%dI' % len(records), *username_ids),
+        pack_strings([i[0] for i in records]),
+        pack_strings([i[3] for i in records]),
+        pack_strings([i[2] for i in records]),
+    ])
+
+
+class PartialRecord(tuple):
+    """
+    A record from a columnar vault whose password hasn't been decoded.
+    """
+    pass
+
+
+class VaultRecord(tuple):
+    """
+    A record from one of several vaults. vault is the InteractiveSession for
+    the vault it's in.
+    """
+    def __new__(cls, record, vault):
+        self = super(VaultRecord, cls).__new__(cls, record)
+        self.vault = vault
+        return self
+
+
+class Columns(object):
+    """
+    The records in a columnar vault, from the data after COLUMNS_MAGIC.
+    Passwords are only decoded when they're asked for.
+    """
+    def __init__(self, data):
+        count, username_count = unpack_from(COLUMNS_HEADER.format, data, 0)
+        offset = COLUMNS_HEADER.size
+        usernames, offset = unpack_strings(data, offset, username_count)
+        username_ids = unpack_from('>%dI' % count, data, offset)
+        offset += 4 * count
+        self.usernames = [usernames[i] for i in username_ids]
+        self.domains, offset = unpack_strings(data, offset, count)
+        self.notes, offset = unpack_strings(data, offset, count)
+        self.password_lengths = unpack_from('>%dI' % count, data, offset)
+        self.passwords_offset = offset + 4 * count
+        if self.passwords_offset + sum(self.password_lengths) != len(data):
+            raise ValueError('truncated columns')
+        self.data = data
+        self.partial_records = [
+            PartialRecord(i) for i in zip(self.domains, self.usernames, [None] * count, self.notes)
+        ]
+
+    def __len__(self):
+        return len(self.domains)
+
+    def password(self, i):
+        start = self.passwords_offset + sum(self.password_lengths[:i])
+        return self.data[start:start + self.password_lengths[i]].decode('utf-8')
+
+    def complete(self, partial_record):
+        """
+        Returns the whole record for one of partial_records.
+        """
+        for i, record in enumerate(self.partial_records):
+            if record is partial_record:
+                return (record[0], record[1], self.password(i), record[3])
+        raise ValueError('not one of our records')
+
+    def __iter__(self):
+        offset = self.passwords_offset
+        for i, length in enumerate(self.password_lengths):
+            password = self.data[offset:offset + length].decode('utf-8')
+            offset += length
+            yield (self.domains[i], self.usernames[i], password, self.notes[i])
+
+
+LAYOUTS = {
+    'packed': pack,
+    'columns': pack_columns,
+}
+
+
+def decode_layout(data):
+    """
+    Returns the layout of data and its records. data can be bytes or a
+    file-like object. The records are a Columns for the columnar layout, and
+    otherwise an iterator that reads a record at a time.
+    """
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    head = data.read(len(PACKED_MAGIC))
+    if head == PACKED_MAGIC:
+        return 'packed', iter_unpack(data)
+    if head == COLUMNS_MAGIC:
+        return 'columns', Columns(data.read())
+    if head == SHARDS_MAGIC:
+        return 'shards', data.read()
+    return 'repr', iter_lines(itertools.chain(io.BytesIO(head + data.readline()), data))
+
+
+def iter_decode(data):
+    """
+    Returns an iterator over the records in data, in any layout.
+    """
+    return iter(decode_layout(data)[1])
+
+
+def decode(str):
+    return list(iter_decode(str))
 
 
 CASE_ALPHABET = string.ascii_letters
@@ -40,25 +270,166 @@ EVERYTHING = ALPHANUMERIC + string.punctuation
 
 
 def gen_password(choices=ALPHANUMERIC, length=10):
-    return ''.join(random.choice(choices) for i in range(length))
+    return ''.join(source.choices(choices, length))
 
 
 def requirements_satisfied(requirements, str):
     return all([i in str for i in requirements])
 
 
+def requirement_classes(requirements):
+    """
+    The sets of characters a password needs one of each of: each character of
+    requirements if it's a string, or each string in it if it's a list.
+    """
+    if isinstance(requirements, (str, type(u''))):
+        requirements = list(requirements)
+    classes = []
+    for requirement in requirements:
+        requirement = frozenset(requirement)
+        if requirement not in classes:
+            classes.append(requirement)
+    return classes
+
+
+class PasswordCounter(object):
+    """
+    Counts the passwords that can be made from choices that meet the
+    requirements in classes. Requirements are bits of a bitmask, and a set of
+    them is counted by inclusion-exclusion over the subsets of it that aren't
+    met: of the passwords of length n, (choices that meet none of the subset)
+    ** n don't meet that subset.
+
+    That's exponential in the number of requirements, unless they're
+    interchangeable, like single required characters are: no choice meets
+    two of them and each is met by as many choices. Then only how many of
+    them are unmet matters, and the subsets of each size are counted at once.
+    """
+    def __init__(self, choices, classes):
+        self.choices = choices
+        self.classes = classes
+        # the indices of the choices that meet each set of requirements
+        groups = {}
+        for i, c in enumerate(choices):
+            meets = sum(1 << j for j, requirement in enumerate(classes) if c in requirement)
+            groups.setdefault(meets, []).append(i)
+        self.groups = sorted(groups.items())
+        self.sizes = {}
+        self.counts = {}
+        met = 0
+        for meets, members in self.groups:
+            met |= meets
+        # the requirements no choice meets
+        self.impossible = ((1 << len(classes)) - 1) & ~met
+        # how many choices meet each requirement, if they're interchangeable.
+        # Then counts is keyed by how many are unmet, instead of which.
+        self.per_requirement = None
+        sizes = set(len(members) for meets, members in self.groups if meets)
+        if len(sizes) == 1 and not self.impossible and all(
+                not meets & (meets - 1) for meets, members in self.groups):
+            self.per_requirement = sizes.pop()
+
+    def meeting_none(self, unmet):
+        """
+        How many choices meet none of the requirements in unmet.
+        """
+        try:
+            return self.sizes[unmet]
+        except KeyError:
+            size = sum(len(members) for meets, members in self.groups if not meets & unmet)
+            self.sizes[unmet] = size
+            return size
+
+    def count(self, length, unmet):
+        """
+        How many passwords of length meet all the requirements in unmet.
+        """
+        if unmet & self.impossible:
+            return 0
+        if self.per_requirement is not None:
+            return self.count_interchangeable(length, bin(unmet).count('1'))
+        try:
+            return self.counts[length, unmet]
+        except KeyError:
+            pass
+        total = 0
+        subset = unmet
+        while True:
+            ways = self.meeting_none(subset) ** length
+            if bin(subset).count('1') % 2:
+                total -= ways
+            else:
+                total += ways
+            if not subset:
+                break
+            subset = (subset - 1) & unmet
+        self.counts[length, unmet] = total
+        return total
+
+    def count_interchangeable(self, length, unmet_count):
+        """
+        count() for interchangeable requirements, of which unmet_count are
+        unmet: there are (unmet_count choose j) subsets of j of them, and
+        per_requirement * j choices meet one of each.
+        """
+        try:
+            return self.counts[length, unmet_count]
+        except KeyError:
+            pass
+        total = 0
+        subsets = 1
+        for j in range(unmet_count + 1):
+            ways = subsets * (len(self.choices) - self.per_requirement * j) ** length
+            if j % 2:
+                total -= ways
+            else:
+                total += ways
+            subsets = subsets * (unmet_count - j) // (j + 1)
+        self.counts[length, unmet_count] = total
+        return total
+
+    def password(self, length):
+        """
+        A random password of length that meets all the requirements, each one
+        as likely as the others.
+        """
+        unmet = (1 << len(self.classes)) - 1
+        password = []
+        for remaining in range(length - 1, -1, -1):
+            i = source.below(self.count(remaining + 1, unmet))
+            for meets, members in self.groups:
+                ways = self.count(remaining, unmet & ~meets)
+                if i < len(members) * ways:
+                    password.append(self.choices[members[i // ways]])
+                    unmet &= ~meets
+                    break
+                i -= len(members) * ways
+        return ''.join(password)
+
+
 def gen_password_require(requirements, choices=ALPHANUMERIC, length=10):
     """
-    Generate a password containing all the characters in requirements
+    Generate a password containing all the characters in requirements, or at
+    least one character of each string in requirements if it's a list.
+
+    Every such password is equally likely. Each character is picked in turn,
+    weighted by how many ways there are to finish the password after it.
     """
-    if len(requirements) > length or not requirements_satisfied(requirements, choices):
-        raise Exception(
+    classes = requirement_classes(requirements)
+    counter = PasswordCounter(choices, classes)
+    unmet = (1 << len(classes)) - 1
+    if not counter.count(length, unmet):
+        raise ValueError(
             "That's impossible, you can't make a password containing %r with only %r!" % (
                 requirements, choices))
-    while True:
-        pw = gen_password(choices, length)
-        if requirements_satisfied(requirements, pw):
-            return pw
+    return counter.password(length)
+
+
+def entropy_length(entropy, choices=ALPHANUMERIC):
+    """
+    How long a password of choices needs to be to have entropy bits.
+    """
+    return int(math.ceil(entropy / math.log(len(choices), 2)))
 
 
 def gen_password_entropy(entropy, choices=ALPHANUMERIC):
@@ -66,8 +437,123 @@ def gen_password_entropy(entropy, choices=ALPHANUMERIC):
     Generates a password of the desired entropy, calculating the length as
     required.
     """
-    required_length = int(math.ceil(entropy / math.log(len(choices), 2)))
-    return gen_password(choices=choices, length=required_length)
+    return gen_password(choices=choices, length=entropy_length(entropy, choices))
+
+
+# the character sets for `sdb gen --charset`
+CHARSETS = {
+    'alphanumeric': ALPHANUMERIC,
+    'everything': EVERYTHING,
+}
+
+# how many passwords gen_passwords draws the randomness for at once
+GEN_BATCH = 1024
+
+
+def check_not_negative(**values):
+    """
+    Raises ValueError if any of values, other than None, is negative.
+    """
+    for name, value in sorted(values.items()):
+        if value is not None and value < 0:
+            raise ValueError("The %s can't be negative, it's %d" % (name, value))
+
+
+def gen_passwords(count, choices=ALPHANUMERIC, length=None, entropy=128, requirements=None):
+    """
+    Generates count passwords, one at a time, each of length or, without a
+    length, with at least entropy bits. With requirements, they're like
+    gen_password_require's, and the entropy counts only the passwords that
+    meet them.
+    """
+    check_not_negative(count=count, length=length, entropy=entropy)
+    if requirements:
+        counter = PasswordCounter(choices, requirement_classes(requirements))
+        unmet = (1 << len(counter.classes)) - 1
+        if length is None:
+            # With one character for each requirement, the rest can be
+            # anything, so it's at most that much longer.
+            length = shortest = entropy_length(entropy, choices)
+            while length < shortest + len(counter.classes) and counter.count(length, unmet) < 2 ** entropy:
+                length += 1
+        if not counter.count(length, unmet):
+            raise ValueError(
+                "That's impossible, you can't make a password containing %r with only %r!" % (
+                    requirements, choices))
+        for i in range(count):
+            yield counter.password(length)
+        return
+    if length is None:
+        length = entropy_length(entropy, choices)
+    if not length:
+        for i in range(count):
+            yield ''
+        return
+    while count > 0:
+        batch = min(count, GEN_BATCH)
+        chars = source.choices(choices, batch * length)
+        for i in range(0, batch * length, length):
+            yield ''.join(chars[i:i + length])
+        count -= batch
+
+
+def gen_passphrases(count, entropy=128, words=None, separator=' ', capitalize=False, word_list=WORDS):
+    """
+    Generates count diceware passphrases, each of words words from word_list
+    or, without words, enough of them to have entropy bits. With capitalize,
+    each word starts with a capital letter.
+    """
+    check_not_negative(count=count, words=words, entropy=entropy)
+    if words is None:
+        words = entropy_length(entropy, word_list)
+    if not words:
+        for i in range(count):
+            yield ''
+        return
+    while count > 0:
+        batch = min(count, GEN_BATCH)
+        chosen = source.choices(word_list, batch * words)
+        if capitalize:
+            chosen = [word.capitalize() for word in chosen]
+        for i in range(0, batch * words, words):
+            yield separator.join(chosen[i:i + words])
+        count -= batch
+
+
+def gen_passphrase(entropy=128, words=None, separator=' ', capitalize=False, word_list=WORDS):
+    """
+    Generates a diceware passphrase, see gen_passphrases.
+    """
+    return next(gen_passphrases(1, entropy, words, separator, capitalize, word_list))
+
+
+def gen_args_passwords(args):
+    """
+    gen_passwords or gen_passphrases, for the options of `sdb gen`.
+    """
+    if getattr(args, 'diceware', False):
+        word_list = WORDS
+        if getattr(args, 'word_list', None):
+            word_list = load_word_list(args.word_list)
+        return gen_passphrases(
+            args.count, args.entropy, args.words, args.separator, args.capitalize, word_list)
+    return gen_passwords(
+        args.count, CHARSETS[args.charset], args.length, args.entropy, args.require)
+
+
+def gen_args_records(args):
+    """
+    The records `sdb gen --add` adds. Raises ValueError if the options or the
+    --add pattern are wrong, before anything is read or written.
+    """
+    try:
+        args.add.format(n=1)
+    except (IndexError, KeyError, AttributeError, ValueError) as e:
+        raise ValueError("Bad --add pattern %r, it can only use {n}: %s" % (args.add, e))
+    return [
+        (args.add.format(n=i), args.username or '', password, args.notes or '')
+        for i, password in enumerate(gen_args_passwords(args), 1)
+    ]
 
 
 def match(needle, haystack):
@@ -85,21 +571,137 @@ def match(needle, haystack):
     return score
 
 
-def record_score(term, records):
-    return match(term, records[0] + records[1] + records[3])
+# the fields of a record that are searched: domain, username and notes
+SEARCHED_FIELDS = (0, 1, 3)
+
+
+def match_fields(needle, record, fields=SEARCHED_FIELDS, weights=None, limits=None, threshold=0):
+    """
+    match(needle, haystack), where haystack is the given fields of record
+    joined together, without joining them: the fields are searched one after
+    another, and last_match is still the position in the joined text.
+
+    A character matched in the k-th field scores weights[k] times as much, and
+    only the first limits[k] characters of it are searched, if they're given.
+    It gives up and returns 0 as soon as the score can't reach threshold:
+    each character left adds at most the biggest weight / (last_match + 1),
+    and last_match only grows.
+    """
+    score = 1
+    last_match = 0
+    remaining = len(needle)
+    most = max(weights) if weights else 1
+    k = 0
+    field = record[fields[0]]
+    # where field starts in the joined text, where to look next in it, and
+    # where to stop
+    offset = 0
+    j = 0
+    end = limits[0] if limits and limits[0] is not None else len(field)
+    try:
+        for c in needle:
+            if threshold and score + most * remaining / (last_match + 1.) < threshold:
+                return 0
+            i = field.find(c, j, end)
+            while i == -1:
+                k += 1
+                if k == len(fields):
+                    return 0
+                offset += len(field)
+                field = record[fields[k]]
+                end = limits[k] if limits and limits[k] is not None else len(field)
+                i = field.find(c, 0, end)
+            if weights:
+                score += weights[k] / (last_match + 1.)
+            else:
+                score += 1 / (last_match + 1.)
+            last_match = offset + i
+            j = i + 1
+            remaining -= 1
+    except TypeError:
+        # text in bytes
+        return 0
+    return score
 
 
-def search(term, records):
-    records = [(record_score(term, i), i) for i in records]
-    records = list(filter(itemgetter(0), records))
-    records.sort(key=itemgetter(0), reverse=True)
-    return [i[1] for i in records]
+def notes_limits(notes_limit):
+    if notes_limit is None:
+        return None
+    return (None, None, notes_limit)
+
+
+def record_score(term, records, weights=None, notes_limit=None):
+    """
+    How well term matches the domain, username and notes of a record.
+    weights are for those three fields, as in match_fields, and only the first
+    notes_limit characters of the notes are searched.
+    """
+    return match_fields(term, records, SEARCHED_FIELDS, weights, notes_limits(notes_limit))
+
+
+def search(term, records, limit=None, weights=None, notes_limit=None):
+    """
+    Returns the records matching term, best first. records can be any
+    iterable, it is only consumed once. weights and notes_limit are passed to
+    record_score.
+
+    With a limit, only the best limit records are returned, the same ones as
+    search(term, records)[:limit], but without sorting all of the matches,
+    and without finishing matching records that can't be good enough.
+    """
+    if limit:
+        return search_top(term, records, limit, weights, notes_limit)
+    results = []
+    for record in records:
+        score = record_score(term, record, weights, notes_limit)
+        if score:
+            results.append((score, record))
+    results.sort(key=itemgetter(0), reverse=True)
+    return [i[1] for i in results]
+
+
+def search_folded(term, records, limit=None, weights=None, notes_limit=None):
+    """
+    search(), regardless of case and accents, see sdb.folding. records can
+    already be FoldedRecords, so they're only folded once.
+    """
+    folded = (r if isinstance(r, FoldedRecord) else FoldedRecord(r) for r in records)
+    return [r.record for r in search(fold(term)[0], folded, limit, weights, notes_limit)]
+
+
+def search_top(term, records, limit, weights=None, notes_limit=None):
+    # A min-heap of the best so far, the worst on top. Of records with the
+    # same score, the first one wins, as with a stable sort.
+    heap = []
+    threshold = 0
+    limits = notes_limits(notes_limit)
+    for i, record in enumerate(records):
+        score = match_fields(term, record, SEARCHED_FIELDS, weights, limits, threshold)
+        if not score:
+            continue
+        if len(heap) < limit:
+            heapq.heappush(heap, (score, -i, record))
+        elif (score, -i) > heap[0][:2]:
+            heapq.heapreplace(heap, (score, -i, record))
+        else:
+            continue
+        if len(heap) == limit:
+            # leave room for rounding in the bound; ties are settled above
+            threshold = heap[0][0] - 1e-9
+    heap.sort(key=itemgetter(0, 1), reverse=True)
+    return [i[2] for i in heap]
 
 
 def is_unique_list(lst):
     return len(lst) == len(set(lst))
 
 
+def check_records(records):
+    assert isinstance(records, list)
+    if not is_unique_list(records):
+        raise Exception("You have two identical records. I don't think you want this.")
+
+
 def disambiguate(records):
     choices = [itemgetter(0),
                itemgetter(0, 1),
@@ -129,20 +731,64 @@ def gpg_exception_factory(returncode, message):
     if returncode == 2:
         if b'decryption failed: bad key' in message:
             return IncorrectPasswordException(message)
+        if b'decryption failed: Bad session key' in message:
+            return IncorrectPasswordException(message)
         if b'CRC error;' in message:
             return FileCorruptionException(message)
         if b'fatal: zlib inflate problem: invalid distance' in message:
             return FileCorruptionException(message)
         if b'decryption failed: invalid packet' in message:
             return FileCorruptionException(message)
+        if b'encrypted message has been manipulated' in message:
+            return FileCorruptionException(message)
         if b'no valid OpenPGP data found':
             return InvalidEncryptedFileException(message)
     return Exception("unkown error", returncode, message)
 
 
-def dencrypt(command, pw, data):
+# how much of the input and output of gpg is held in memory at once
+CHUNK_SIZE = 64 * 1024
+
+
+def _feed(stdin, pw, input):
+    try:
+        try:
+            stdin.write(force_bytes(pw))
+            stdin.write(b'\n')
+            while True:
+                chunk = input.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                stdin.write(chunk)
+        finally:
+            stdin.close()
+    except IOError:
+        # it exited without reading everything, and will say why
+        pass
+
+
+def _drain(f, chunks):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+
+
+@contextmanager
+def dencrypt_stream(command, pw, input):
     """
-    Encrypts or decrypts, by running command
+    Runs command, with pw and then the contents of the file-like object input
+    on its stdin, and gives its stdout as a file-like object::
+
+        with dencrypt_stream(command, pw, f) as output:
+            for chunk in iter(lambda: output.read(CHUNK_SIZE), b''):
+                ...
+
+    The input is written from another thread, so command never waits for
+    its output to be read while it's being given input, or the other way
+    around. If command fails, the exception is raised when the with block
+    ends, so nothing read from output can be trusted until then.
     """
     if '\n' in pw:
         raise Exception('Newlines not allowed in passwords')
@@ -152,34 +798,262 @@ def dencrypt(command, pw, data):
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE
     )
-    proc.stdin.write(force_bytes(pw))
-    proc.stdin.write(b'\n')
-    proc.stdin.write(data)
-    output, erroroutput = proc.communicate()
+    erroroutput = []
+    threads = [
+        threading.Thread(target=_feed, args=(proc.stdin, pw, input)),
+        threading.Thread(target=_drain, args=(proc.stderr, erroroutput)),
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        yield proc.stdout
+        # whatever wasn't read, so it can finish
+        _drain(proc.stdout, [])
+    except:
+        proc.kill()
+        raise
+    finally:
+        proc.stdout.close()
+        proc.wait()
+        for thread in threads:
+            thread.join()
+        proc.stderr.close()
     if proc.returncode != 0:
-        raise gpg_exception_factory(proc.returncode, erroroutput)
-    return output
-
-
-def encrypt(pw, data):
-    return dencrypt(
-        ['gpg', '-c',
-         '--passphrase-fd', '0',
-         '--batch',
-         '--armor',
-         '--cipher-algo', 'AES',
-         '--digest-algo', 'SHA256'],
-        pw,
-        data,
-    )
+        raise gpg_exception_factory(proc.returncode, b''.join(erroroutput))
+
+
+def dencrypt(command, pw, data, output=None):
+    """
+    Encrypts or decrypts, by running command. data is bytes or a file-like
+    object. Returns the result, or writes it to the file-like object output.
+    """
+    if isinstance(data, bytes):
+        data = io.BytesIO(data)
+    with dencrypt_stream(command, pw, data) as stdout:
+        if output is None:
+            chunks = []
+            _drain(stdout, chunks)
+        else:
+            shutil.copyfileobj(stdout, output, CHUNK_SIZE)
+    if output is None:
+        return b''.join(chunks)
+
+
+class Backend(object):
+    def encrypt_digest(self, pw, data, armor=True, settings=None):
+        """
+        Returns the encrypted data, and the sha256 digest of what it decrypts
+        to. Here that means decrypting it again, backends that can do it
+        without deriving the key again override this.
+        """
+        ciphertext = self.encrypt(pw, data, armor, settings)
+        return ciphertext, hashlib.sha256(self.decrypt(pw, ciphertext)).digest()
+
+    @contextmanager
+    def decrypt_stream(self, pw, f):
+        """
+        Decrypts the file-like object f, giving the plaintext as a file-like
+        object.
+        """
+        yield io.BytesIO(self.decrypt(pw, f.read()))
+
+
+class SubprocessBackend(Backend):
+    """
+    Encrypts and decrypts by running gpg.
+    """
+    def encrypt(self, pw, data, armor=True, settings=None, output=None):
+        settings = settings or ENCRYPTION_DEFAULTS
+        return dencrypt(
+            ['gpg', '-c',
+             '--passphrase-fd', '0',
+             '--batch',
+             '--armor' if armor else '--no-armor',
+             '--cipher-algo', settings['cipher'],
+             '--digest-algo', settings['digest'],
+             '--s2k-digest-algo', settings['digest'],
+             '--s2k-count', str(settings['s2k_count']),
+             '--compress-algo', settings['compression']],
+            pw,
+            data,
+            output,
+        )
+
+    decrypt_command = ['gpg', '-d', '--passphrase-fd', '0', '--batch']
+
+    def decrypt(self, pw, data):
+        return dencrypt(self.decrypt_command, pw, data)
+
+    def decrypt_stream(self, pw, f):
+        return dencrypt_stream(self.decrypt_command, pw, f)
+
+
+class OpenPGPBackend(Backend):
+    """
+    Encrypts and decrypts in-process, writing the same files as gpg. Files
+    using anything sdb.openpgp doesn't implement are handed to gpg, and so
+    are big files if AES has to be done in pure python. Files too big to hold
+    in memory are streamed through gpg.
+    """
+    fallback = SubprocessBackend()
+
+    # past this, gpg is faster than the pure python AES
+    SLOW_LIMIT = 128 * 1024
+    # past this, decrypt_stream() lets gpg decrypt the file a chunk at a time
+    # instead of reading all of it
+    STREAM_LIMIT = 8 * 1024 * 1024
+
+    def use_fallback(self, data):
+        return not openpgp.FAST and len(data) > self.SLOW_LIMIT
+
+    def encrypt(self, pw, data, armor=True, settings=None):
+        if self.use_fallback(data):
+            return self.fallback.encrypt(pw, data, armor, settings)
+        if '\n' in pw:
+            raise Exception('Newlines not allowed in passwords')
+        return openpgp.encrypt(force_bytes(pw), data, armored=armor, **(settings or ENCRYPTION_DEFAULTS))
+
+    def encrypt_digest(self, pw, data, armor=True, settings=None):
+        if self.use_fallback(data):
+            return self.fallback.encrypt_digest(pw, data, armor, settings)
+        if '\n' in pw:
+            raise Exception('Newlines not allowed in passwords')
+        try:
+            return openpgp.encrypt_digest(force_bytes(pw), data, armored=armor, **(settings or ENCRYPTION_DEFAULTS))
+        except openpgp.OpenPGPError as e:
+            # what it just encrypted doesn't decrypt
+            raise FileCorruptionException(str(e))
+
+    def decrypt(self, pw, data):
+        if self.use_fallback(data):
+            return self.fallback.decrypt(pw, data)
+        if '\n' in pw:
+            raise Exception('Newlines not allowed in passwords')
+        try:
+            return openpgp.decrypt(force_bytes(pw), data)
+        except openpgp.BadPassphrase as e:
+            raise IncorrectPasswordException(str(e))
+        except openpgp.CorruptData as e:
+            raise FileCorruptionException(str(e))
+        except openpgp.NoData as e:
+            raise InvalidEncryptedFileException(str(e))
+        except openpgp.Unsupported:
+            return self.fallback.decrypt(pw, data)
+
+    @contextmanager
+    def decrypt_stream(self, pw, f):
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except (AttributeError, io.UnsupportedOperation):
+            size = 0
+        if size > self.STREAM_LIMIT or (not openpgp.FAST and size > self.SLOW_LIMIT):
+            with self.fallback.decrypt_stream(pw, f) as plaintext:
+                yield plaintext
+        else:
+            yield io.BytesIO(self.decrypt(pw, f.read()))
+
+
+BACKENDS = {
+    'gpg': SubprocessBackend,
+    'openpgp': OpenPGPBackend,
+}
+
+
+def in_process_aes():
+    """
+    Whether to do AES in-process: when cryptography does it, or when
+    $SDB_BACKEND asks for the in-process backend, which is then the pure
+    python AES. That uses lookup tables indexed by the key and data, which
+    can leak them through the cache timing, so it isn't used otherwise.
+    """
+    return openpgp.FAST or os.environ.get('SDB_BACKEND') == 'openpgp'
+
+
+def get_backend():
+    """
+    The backend named by $SDB_BACKEND. Without one, the in-process backend
+    if cryptography is installed, and gpg if it isn't.
+    """
+    name = os.environ.get('SDB_BACKEND') or ('openpgp' if openpgp.FAST else 'gpg')
+    return BACKENDS[name]()
+
+
+def encrypt(pw, data, armor=True, settings=None):
+    """
+    Encrypts data with the password pw, as ASCII armor or, if armor is false,
+    as binary OpenPGP packets. decrypt() takes either.
+
+    settings are the algorithms and S2K count to use, as in
+    sdb.config.ENCRYPTION_DEFAULTS.
+    """
+    return get_backend().encrypt(pw, data, armor, settings)
+
+
+def encrypt_digest(pw, data, armor=True, settings=None):
+    return get_backend().encrypt_digest(pw, data, armor, settings)
 
 
 def decrypt(pw, data):
-    return dencrypt(
-        ['gpg', '-d', '--passphrase-fd', '0', '--batch'],
-        pw,
-        data
-    )
+    return get_backend().decrypt(pw, data)
+
+
+def decrypt_stream(pw, f):
+    """
+    A context manager that decrypts the file-like object f, giving the
+    plaintext as a file-like object. A big file is streamed, rather than
+    decrypted all at once, when the backend can.
+    """
+    return get_backend().decrypt_stream(pw, f)
+
+
+# How a write checks the file it wrote. 'full' decrypts it again, 'digest'
+# compares a digest of the plaintext with one of what the backend's output
+# decrypts to, which the in-process backend gets without redoing the S2K, and
+# 'async' decrypts it again while the file is being synced, and puts back the
+# previous file if it doesn't match.
+VERIFY_LEVELS = ('full', 'digest', 'async')
+
+
+DEFAULT_SHARD_COUNT = 16
+
+# past this many entries, the journal is compacted into the file
+JOURNAL_COMPACT_ENTRIES = 100
+
+
+def diff_records(current, records):
+    """
+    Returns the deltas that turn current into records, or None if it takes
+    more than one. A delta is a list of records, starting with the operation.
+    """
+    if len(records) == len(current) + 1 and records[:-1] == current:
+        return [[(u'add',), records[-1]]]
+    if len(records) == len(current):
+        changed = [i for i, record in enumerate(records) if record != current[i]]
+        if not changed:
+            return []
+        if len(changed) == 1:
+            i, = changed
+            return [[(u'replace',), current[i], records[i]]]
+    if len(records) == len(current) - 1:
+        for i, record in enumerate(current):
+            if i == len(records) or records[i] != record:
+                break
+        if current[:i] + current[i + 1:] == records:
+            return [[(u'delete',), current[i]]]
+    return None
+
+
+def apply_delta(records, delta):
+    operation = delta[0][0]
+    if operation == u'add':
+        records.append(delta[1])
+    elif operation == u'replace':
+        records[records.index(delta[1])] = delta[2]
+    elif operation == u'delete':
+        records.remove(delta[1])
+    else:
+        raise ValueError('unknown operation %r' % operation)
 
 
 def get_tmp_file(filename):
@@ -192,8 +1066,25 @@ def get_backup_file(filename):
     return os.path.join(*file_parts[:-1] + ('.' + file_parts[-1].lstrip('.') + '.bak',))
 
 
+def get_journal_file(filename):
+    file_parts = os.path.split(filename)
+    return os.path.join(*file_parts[:-1] + ('.' + file_parts[-1].lstrip('.') + '.journal',))
+
+
+def get_socket_file(filename):
+    file_parts = os.path.split(filename)
+    return os.path.join(*file_parts[:-1] + ('.' + file_parts[-1].lstrip('.') + '.sock',))
+
+
+class KeepFile(Exception):
+    """
+    Raise inside atomic_replace() to leave the file as it is.
+    """
+    pass
+
+
 @contextmanager
-def atomic_replace(filename):
+def atomic_replace(filename, backup=True):
     """
     ::
         with atomic_replace(filename) as f:
@@ -203,6 +1094,9 @@ def atomic_replace(filename):
             f.write('asdf')
             raise Exception
         # nothing happens to the file
+
+    The previous contents are kept in the backup file, unless backup is
+    false.
     """
     tmpfile_name = get_tmp_file(filename)
     fd = os.open(tmpfile_name, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
@@ -220,9 +1114,11 @@ def atomic_replace(filename):
                 current_content = current_f.read()
         except IOError:
             current_content = b''
-        if current_content != new_content:
+        if backup and current_content != new_content:
             with open(get_backup_file(filename), 'w+b') as backup_file:
                 backup_file.write(current_content)
+    except KeepFile:
+        os.unlink(tmpfile_name)
     except:
         # If there was an exception, remove the temporary file and reraise
         os.unlink(tmpfile_name)
@@ -234,6 +1130,20 @@ def atomic_replace(filename):
         f.close()
 
 
+def restore_backup(filename):
+    """
+    Puts back the contents filename had before the last atomic_replace.
+    """
+    with open(get_backup_file(filename), 'rb') as f:
+        content = f.read()
+    if not content:
+        # it didn't exist
+        os.unlink(filename)
+        return
+    with atomic_replace(filename, backup=False) as f:
+        f.write(content)
+
+
 def edit_in_editor(current):
     EDITOR = os.environ.get('EDITOR', 'vim')
     with tempfile.NamedTemporaryFile(mode='w+') as f:
@@ -257,11 +1167,41 @@ def pretty_record(record):
 
 
 class InteractiveSession(object):
-    def __init__(self, args, output=sys.stdout, input=sys.stdin, password=None):
+    def __init__(self, args, output=sys.stdout, input=sys.stdin, password=None, daemon=None):
         self.args = args
         self.file = args.file
+        # what to call the vault when there are several
+        self.name = getattr(args, 'name', None) or os.path.basename(self.file)
         self.output = output
         self.input = input
+        # a client for `sdb serve`, which has the records and the password
+        self.daemon = daemon
+        # how the records are written, see LAYOUTS
+        self.layout = 'packed'
+        self.columns = None
+        # the Manifest of a sharded vault
+        self.manifest = None
+        # write changes to the journal instead of the file
+        self.journal = getattr(args, 'journal', False)
+        # the key packet of the journal read with the file, and its key, or
+        # None if there wasn't one
+        self.journal_key = None
+        # how many entries that journal has, and where the last one ends
+        self.journal_entries = 0
+        self.journal_end = 0
+        # whether the file is ASCII armored, rather than binary
+        self.armor = True
+        # the algorithms and S2K count to encrypt with, see sdb.config
+        self.settings = read_encryption_settings(self.file)
+        # how many matches to choose from
+        self.limit = getattr(args, 'limit', None)
+        # one of VERIFY_LEVELS
+        self.verify = getattr(args, 'verify', None) or 'digest'
+        # the threads checking the files written with verify='async'
+        self.pending = []
+        # held while asking for the password. A Federation gives its vaults
+        # the same one, so they don't ask at the same time.
+        self.password_lock = threading.Lock()
 
         try:
             self.gpg_agent = gpg_agent.GpgAgent()
@@ -273,29 +1213,30 @@ class InteractiveSession(object):
         )
 
         self.password = password
-        if not self.password:
+        if not self.password and not self.daemon:
             self.password = self.get_master_password()
 
     def get_master_password(self, error=None):
         if self.password:
             return self.password
 
-        if self.input == sys.stdin:
-            if self.gpg_agent:
-                error = error or 'X'
-                self.password = self.gpg_agent.get_passphrase(
-                    self.gpg_agent_password_id,
-                    prompt='Master password',
-                    error=error
-                )
+        with self.password_lock:
+            if self.input == sys.stdin:
+                if self.gpg_agent:
+                    error = error or 'X'
+                    self.password = self.gpg_agent.get_passphrase(
+                        self.gpg_agent_password_id,
+                        prompt='Master password',
+                        error=error
+                    )
+                else:
+                    if error:
+                        self.output.write('Error: {error}, try again: '.format(error=error))
+                    self.password = getpass()
             else:
-                if error:
-                    self.output.write('Error: {error}, try again: '.format(error=error))
-                self.password = getpass()
-        else:
-            self.output.write('Password: ')
-            self.output.flush()
-            self.password = self.input.readline().rstrip('\n')
+                self.output.write('Password: ')
+                self.output.flush()
+                self.password = self.input.readline().rstrip('\n')
         return self.password
 
     def clear_master_password(self):
@@ -318,10 +1259,14 @@ class InteractiveSession(object):
         domain = domain or self.prompt('Domain: ')
         username = self.prompt('Username: ')
         password = self.prompt(
-            'Password [blank to generate]: ',
+            'Password [blank or g to generate, d for diceware]: ',
             required=False,
             password=True
-        ) or gen_password_entropy(128)
+        )
+        if not password or password == 'g':
+            password = gen_password_entropy(128)
+        elif password == 'd':
+            password = gen_passphrase()
         notes = self.prompt('Notes: ', required=False)
 
         return (domain, username, password, notes)
@@ -330,9 +1275,11 @@ class InteractiveSession(object):
         new_record = list(record)
         new_record[0] = self.prompt('Name [%s]: ' % record[0], required=False) or record[0]
         new_record[1] = self.prompt('Username [%s]: ' % record[1], required=False) or record[1]
-        pw = self.prompt('Password []/g: ', required=False, password=True) or record[2]
+        pw = self.prompt('Password []/g/d: ', required=False, password=True) or record[2]
         if pw == 'g':
             new_record[2] = gen_password_entropy(128)
+        elif pw == 'd':
+            new_record[2] = gen_passphrase()
         elif pw:
             new_record[2] = pw
         self.output.write("Notes: %s\n" % record[3])
@@ -341,41 +1288,345 @@ class InteractiveSession(object):
             new_record[3] = edit_in_editor(record[3])
         return tuple(new_record)
 
+    def use_picker(self):
+        """
+        Whether to choose records with the full screen picker, rather than
+        from a numbered list.
+        """
+        if not getattr(self.args, 'picker', True) or self.input != sys.stdin:
+            return False
+        from sdb import picker
+        return picker.curses is not None and sys.stdin.isatty() and self.output.isatty()
+
     def find_record(self, query, records):
-        possibilities = search(query, records)
+        if self.use_picker():
+            from sdb.picker import Picker, pick
+            picker = Picker(records, query)
+            if len(picker) > 1:
+                return pick(picker)
+            possibilities = [folded.record for folded in picker.searcher.results()]
+        else:
+            possibilities = search_folded(query, records, self.limit)
+        return self.choose_record(possibilities)
+
+    def choose_record(self, possibilities):
+        """
+        Asks which of possibilities, the results of a search, is wanted.
+        """
         if len(possibilities) > 1:
             choices = disambiguate(possibilities)
             for i, choice in enumerate(choices):
-                self.output.write('%s) %s\n' % (i, choice))
+                vault = getattr(possibilities[i], 'vault', None)
+                if vault:
+                    self.output.write('%s) [%s] %s\n' % (i, vault.name, choice))
+                else:
+                    self.output.write('%s) %s\n' % (i, choice))
             choice = self.prompt('Which did you mean? [0]: ', required=False) or 0
             return possibilities[int(choice)]
         else:
             return possibilities[0]
 
-    def read_records(self, error=None):
+    @contextmanager
+    def open_decrypted(self, filename, error=None):
+        """
+        Gives the decrypted contents of filename as a file-like object, or
+        None if it doesn't exist. Asks for the password again if it's wrong.
+        """
         try:
-            with open(self.file, 'rb') as f:
+            f = open(filename, 'rb')
+        except IOError:
+            yield None
+            return
+        with f:
+            if filename == self.file:
+                # keep writing it the same way
+                self.armor = openpgp.is_armored(f.read(64))
+            yielded = False
+            while True:
                 password = self.get_master_password(error)
+                f.seek(0)
                 try:
-                    return decode(decrypt(password, f.read()))
+                    with decrypt_stream(password, f) as plaintext:
+                        # if there's no output, it probably failed, and says
+                        # why once it's finished. Wait for that, so the
+                        # password can be asked for again.
+                        peek = getattr(plaintext, 'peek', None)
+                        empty = peek is not None and not peek(1)
+                        if not empty:
+                            yielded = True
+                            yield plaintext
+                    if empty:
+                        yield io.BytesIO(b'')
+                    return
                 except IncorrectPasswordException:
                     self.clear_master_password()
-                    return self.read_records(error='Incorrect password')
+                    if yielded:
+                        raise
                 except:
                     self.clear_master_password()
                     raise
+                error = 'Incorrect password'
+
+    def decrypt_file(self, filename, error=None):
+        """
+        Returns the decrypted contents of filename, or None if it doesn't
+        exist.
+        """
+        with self.open_decrypted(filename, error) as plaintext:
+            if plaintext is None:
+                return None
+            return plaintext.read()
+
+    def iter_records(self, error=None, partial=False, domain=None):
+        """
+        Yields the records one at a time, without building a list of them.
+
+        If partial is true, records from a columnar vault are PartialRecords,
+        without their passwords. self.columns.complete() fills them in.
+
+        If domain is given, only the records for exactly that domain are
+        returned, and a sharded vault only decrypts the segment they're in.
+        """
+        if self.daemon:
+            records = iter_decode(self.daemon.read())
+        else:
+            records = self.iter_file_records(error, partial, None if domain is None else [domain])
+        for record in records:
+            if domain is None or record[0] == domain:
+                yield record
+
+    def iter_file_records(self, error, partial, domains):
+        """
+        Yields the records in the file and its journal. If domains is given,
+        a sharded vault only decrypts the segments those domains are in, and
+        yields all the records in them.
+        """
+        with self.open_decrypted(self.file, error) as plaintext:
+            entries = self.read_journal()
+            if plaintext is None:
+                records = []
+            else:
+                layout, records = decode_layout(plaintext)
+                if layout in LAYOUTS:
+                    # keep writing it the same way. Anything else gets upgraded.
+                    self.layout = layout
+                if layout == 'columns':
+                    self.columns = records
+                    if partial and not entries:
+                        records = records.partial_records
+                if layout == 'shards':
+                    self.manifest = Manifest.decode(self.file, records)
+                    # a manifest that gets or loses its key is written again
+                    # whole, so all of it is needed
+                    rekey = bool(self.manifest.data_key) != in_process_aes()
+                    if domains is None or entries or rekey:
+                        records = self.iter_segments(range(len(self.manifest.segments)))
+                    else:
+                        records = self.iter_segments(sorted(set(self.manifest.shard(d) for d in domains)))
+            if entries:
+                records = list(records)
+                for delta in entries:
+                    apply_delta(records, delta)
+            for record in records:
+                yield record
+
+    def base_digest(self):
+        try:
+            with open(self.file, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest().encode('ascii')
+        except IOError:
+            return hashlib.sha256(b'').hexdigest().encode('ascii')
+
+    def read_journal(self):
+        """
+        Returns the deltas in the journal. A journal that was started for a
+        different version of the file has already been compacted into it, and
+        is ignored.
+
+        The entries are only encrypted data packets. They're all encrypted
+        with the key from the key packet at the start of the journal, so it
+        only has to be derived from the password once. Without in-process AES
+        there's no key packet, and each entry is a whole message.
+
+        An entry cut short by a write that didn't finish can only be the last
+        one, and is left out. append_journal() writes over it. Anything else
+        that doesn't decrypt raises FileCorruptionException.
+        """
+        known, self.journal_key = self.journal_key, None
+        self.journal_entries = 0
+        self.journal_end = 0
+        try:
+            f = open(get_journal_file(self.file), 'rb')
         except IOError:
             return []
+        deltas = []
+        with f:
+            if f.readline().rstrip(b'\n') != self.base_digest():
+                return []
+            line = f.readline()
+            try:
+                if not line.endswith(b'\n'):
+                    raise ValueError('no key packet')
+                key_packet = binascii.unhexlify(line.rstrip(b'\n'))
+                if not key_packet:
+                    key = None
+                elif known and known[0] == key_packet:
+                    key = known[1]
+                else:
+                    key = openpgp.read_key_packet(force_bytes(self.password), key_packet)
+            except (TypeError, ValueError, openpgp.OpenPGPError):
+                # the header of a journal that didn't get written completely
+                return []
+            end = f.tell()
+            while True:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    # the end of a write that didn't finish
+                    break
+                try:
+                    length = int(line)
+                except ValueError:
+                    raise FileCorruptionException('%s: invalid entry length' % get_journal_file(self.file))
+                entry = f.read(length)
+                if len(entry) < length:
+                    # the end of a write that didn't finish
+                    break
+                if key is None:
+                    deltas.append(decode(decrypt(self.password, entry)))
+                    end = f.tell()
+                    continue
+                try:
+                    deltas.append(decode(openpgp.decrypt_packet(key, entry)))
+                except openpgp.BadPassphrase as e:
+                    raise IncorrectPasswordException(str(e))
+                except (openpgp.OpenPGPError, ValueError) as e:
+                    raise FileCorruptionException('%s: %s' % (get_journal_file(self.file), e))
+                end = f.tell()
+        self.journal_key = key_packet, key
+        self.journal_entries = len(deltas)
+        self.journal_end = end
+        return deltas
+
+    def append_journal(self, current, records):
+        """
+        Appends the changes from current to records to the journal that was
+        read with current, returning False if they should be written to the
+        file instead.
+        """
+        deltas = diff_records(current, records)
+        if deltas is None:
+            return False
+        if self.journal_entries + len(deltas) > JOURNAL_COMPACT_ENTRIES:
+            return False
+
+        fresh = self.journal_key is None
+        if fresh and in_process_aes():
+            self.journal_key = openpgp.new_key_packet(
+                force_bytes(self.password), self.settings['cipher'], self.settings['digest'],
+                self.settings['s2k_count'])
+        elif fresh:
+            self.journal_key = b'', None
+        key_packet, key = self.journal_key
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if fresh:
+            flags |= os.O_TRUNC
+        with os.fdopen(os.open(get_journal_file(self.file), flags, 0o600), 'wb') as f:
+            if fresh:
+                f.write(self.base_digest() + b'\n')
+                f.write(binascii.hexlify(key_packet) + b'\n')
+            else:
+                # over anything after the last entry that was read
+                f.truncate(self.journal_end)
+            for delta in deltas:
+                plaintext = pack(delta)
+                assert delta == decode(plaintext)
+                # the journal can't be put back, so check it before writing
+                if key is None:
+                    entry, digest = encrypt_digest(self.password, plaintext, False, self.settings)
+                    assert digest == hashlib.sha256(plaintext).digest()
+                else:
+                    entry = openpgp.encrypt_data(key, plaintext, self.settings['compression'])
+                    assert openpgp.decrypt_packet(key, entry) == plaintext
+                f.write(('%d\n' % len(entry)).encode('ascii'))
+                f.write(entry)
+            f.flush()
+            os.fsync(f.fileno())
+            self.journal_end = os.fstat(f.fileno()).st_size
+        self.journal_entries += len(deltas)
+        return True
+
+    def iter_segments(self, shards):
+        for i in shards:
+            if self.manifest.data_key:
+                plaintext = self.decrypt_segment(self.manifest.path(i))
+            else:
+                plaintext = self.decrypt_file(self.manifest.path(i))
+            if plaintext is None:
+                raise Exception("The segment file %s is missing" % self.manifest.path(i))
+            for record in iter_decode(plaintext):
+                yield record
+
+    def decrypt_segment(self, filename):
+        """
+        Returns the decrypted contents of the segment file filename, or None
+        if it doesn't exist.
+        """
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        try:
+            if openpgp.is_armored(data):
+                data = openpgp.dearmor(data)
+            return openpgp.decrypt_packet(self.manifest.data_key, data)
+        except openpgp.OpenPGPError as e:
+            raise FileCorruptionException('%s: %s' % (filename, e))
+
+    def encrypt_segment(self, manifest, plaintext):
+        """
+        Encrypts plaintext with the key of manifest, and checks that it
+        decrypts again. Segments of a manifest without a key are encrypted
+        with the password.
+        """
+        if not manifest.data_key:
+            return self.encrypt_checked(plaintext)
+        data = openpgp.encrypt_data(manifest.data_key, plaintext, self.settings['compression'])
+        assert openpgp.decrypt_packet(manifest.data_key, data) == plaintext
+        if self.armor:
+            return openpgp.armor(data)
+        return data
+
+    def read_records(self, error=None, domains=None):
+        """
+        Returns all the records, or, if domains is given, at least the ones
+        that share a segment of a sharded vault with those domains.
+        """
+        if domains is None or self.daemon:
+            return list(self.iter_records(error))
+        return list(self.iter_file_records(error, False, domains))
 
     def add_action(self):
         record = self.get_record(self.args.domain or self.prompt('Domain: '))
 
         def add(records):
             return records + [record]
-        self.edit_transaction(add)
+        self.edit_transaction(add, domains=[record[0]])
 
     def show_action(self, clipboard=10):
-        record = self.find_record(self.args.domain or self.prompt("Domain: "), self.read_records())
+        query = self.args.domain or self.prompt("Domain: ")
+        if getattr(self.args, 'exact', False):
+            record = self.find_record(query, self.iter_records(partial=True, domain=query))
+        elif self.daemon and not self.use_picker():
+            # it has an index
+            record = self.choose_record(decode(self.daemon.search(query, self.limit)))
+        else:
+            record = self.find_record(query, self.iter_records(partial=True))
+        if isinstance(record, PartialRecord):
+            record = self.columns.complete(record)
+        return self.show_record(record, clipboard)
+
+    def show_record(self, record, clipboard=10):
         self.output.write(pretty_record(record))
         self.output.write("\n")
         if clipboard:
@@ -391,15 +1642,130 @@ class InteractiveSession(object):
         else:
             return record[2]
 
-    def edit_transaction(self, callback):
+    def edit_transaction(self, callback, layout=None, shard_count=None, armor=None, domains=None):
+        """
+        Replaces the records with callback(records).
+
+        In journal mode, a change to one record is appended to the journal,
+        until it gets big enough that the next change rewrites the file with
+        all of them instead.
+
+        The file keeps its layout unless layout is given. For the 'shards'
+        layout, shard_count is the number of segments. Likewise, it stays
+        ASCII armored or binary unless armor is given.
+
+        If domains is given, a sharded vault only decrypts and rewrites the
+        segments those domains are in, and callback only gets the records in
+        them. Every record callback adds or changes has to be for one of
+        domains.
+
+        What was written is checked as self.verify says, see VERIFY_LEVELS.
+        """
+        if self.daemon:
+            current = self.daemon.read()
+            records = callback(decode(current))
+            check_records(records)
+            self.daemon.write(current, pack(records))
+            return
+        self.pending = []
+        if layout is not None or shard_count is not None or armor is not None:
+            # all of it gets rewritten
+            domains = None
         with atomic_replace(self.file) as out:
-            records = callback(self.read_records())
-            assert isinstance(records, list)
-            if not is_unique_list(records):
-                raise Exception("You have two identical records. I don't think you want this.")
-            out.write(encrypt(self.password, encode(records)))
-            out.seek(0)
-            assert records == decode(decrypt(self.password, out.read()))
+            current = self.read_records(domains=domains)
+            if self.journal_key is None and os.path.exists(get_journal_file(self.file)):
+                # left over from before the last time it was compacted
+                os.unlink(get_journal_file(self.file))
+            records = callback(list(current))
+            check_records(records)
+            if armor is not None:
+                self.armor = armor
+            if self.journal and layout is None and shard_count is None and armor is None:
+                if self.append_journal(current, records):
+                    raise KeepFile()
+            if layout is None:
+                layout = 'shards' if self.manifest else self.layout
+            if layout == 'shards':
+                manifest = self.write_segments(current, records, shard_count, rewrite=armor is not None)
+                plaintext = manifest.encode()
+            else:
+                manifest = None
+                plaintext = LAYOUTS[layout](records)
+                assert records == decode(plaintext)
+            out.write(self.encrypt_checked(plaintext))
+            # the segments of the manifest we read are kept as a backup
+            remove_unused_segments(self.file, self.manifest, manifest)
+        try:
+            self.finish_verify()
+        except:
+            restore_backup(self.file)
+            raise
+
+    def encrypt_checked(self, plaintext):
+        """
+        Encrypts plaintext, and checks the result as self.verify says. With
+        'async', the check runs in a thread, and finish_verify() raises if it
+        failed.
+        """
+        if self.verify == 'digest':
+            ciphertext, digest = encrypt_digest(self.password, plaintext, self.armor, self.settings)
+            assert digest == hashlib.sha256(plaintext).digest()
+            return ciphertext
+        ciphertext = encrypt(self.password, plaintext, self.armor, self.settings)
+        if self.verify == 'full':
+            self.check_encrypted(ciphertext, plaintext)
+        else:
+            errors = []
+
+            def check():
+                try:
+                    self.check_encrypted(ciphertext, plaintext)
+                except Exception as e:
+                    errors.append(e)
+            thread = threading.Thread(target=check)
+            thread.daemon = True
+            thread.start()
+            self.pending.append((thread, errors))
+        return ciphertext
+
+    def check_encrypted(self, ciphertext, plaintext):
+        assert decrypt(self.password, ciphertext) == plaintext
+
+    def finish_verify(self):
+        """
+        Waits for the checks started by encrypt_checked, raising the first
+        error from them.
+        """
+        pending, self.pending = self.pending, []
+        errors = []
+        for thread, thread_errors in pending:
+            thread.join()
+            errors.extend(thread_errors)
+        if errors:
+            raise errors[0]
+
+    def write_segments(self, current, records, shard_count=None, rewrite=False):
+        """
+        Writes new files for the segments that changed between current and
+        records, or for all of them if rewrite is true, and returns the
+        manifest that refers to them.
+        """
+        old_parts = None
+        manifest = self.manifest
+        keyed = in_process_aes()
+        if not manifest or bool(manifest.data_key) != keyed or shard_count not in (None, len(manifest.segments)):
+            manifest = Manifest.create(self.file, shard_count or DEFAULT_SHARD_COUNT, keyed)
+        elif not rewrite:
+            old_parts = manifest.partition(current)
+        parts = manifest.partition(records)
+        changed = [i for i, part in enumerate(parts) if not old_parts or part != old_parts[i]]
+        manifest = manifest.replace(changed)
+        for i in changed:
+            plaintext = pack(parts[i])
+            assert parts[i] == decode(plaintext)
+            with atomic_replace(manifest.path(i), backup=False) as out:
+                out.write(self.encrypt_segment(manifest, plaintext))
+        return manifest
 
     def edit_action(self):
         def edit(records):
@@ -426,10 +1792,59 @@ class InteractiveSession(object):
             return records
         self.edit_transaction(delete)
 
+    def convert_action(self):
+        """
+        Rewrite the file in another layout, or as binary or ASCII armor.
+        """
+        self.edit_transaction(
+            lambda records: records,
+            layout=getattr(self.args, 'layout', None),
+            shard_count=getattr(self.args, 'shards', None),
+            armor=getattr(self.args, 'armor', None),
+        )
+
+    def compact_action(self):
+        """
+        Rewrite the file with the changes in the journal.
+        """
+        self.journal = False
+        self.edit_transaction(lambda records: records)
+
+    def tune_action(self):
+        """
+        Picks the encryption settings that make decrypting the file take
+        args.target milliseconds, and rewrites it with them.
+        """
+        records = self.read_records()
+        target = getattr(self.args, 'target', None) or 150
+
+        def report(line):
+            self.output.write(line + '\n')
+        settings, seconds = tune(
+            get_backend(), pack(records), target / 1000.0, armor=self.armor, report=report)
+        self.output.write('Using %s, %s, %d S2K bytes, %s compression: %.1f ms\n' % (
+            settings['cipher'], settings['digest'], settings['s2k_count'],
+            settings['compression'], seconds * 1000))
+        write_encryption_settings(self.file, settings)
+        self.settings = settings
+        # rewrite all of it, even a journal or the segments of a sharded vault
+        self.edit_transaction(lambda records: records, armor=self.armor)
+
+    def gen_action(self, new_records=None):
+        """
+        Adds --count records with new passwords, named from the --add
+        pattern, in one go. new_records are the records from
+        gen_args_records(), if they've been made already.
+        """
+        if new_records is None:
+            new_records = gen_args_records(self.args)
+        self.edit_transaction(lambda records: records + new_records, domains=[r[0] for r in new_records])
+
     def raw_action(self):
         try:
             # PY3
             output = self.output.buffer
         except AttributeError:
             output = self.output
-        output.write(encode(self.read_records()))
+        for record in self.iter_records():
+            output.write(encode([record]))
@@ -0,0 +1,162 @@
+"""
+A full screen picker for choosing a record: type to narrow down the records,
+move with the arrow keys, and press enter to choose one, or escape to give up.
+
+Picker is the state of it, which the curses part just draws and feeds keys to.
+"""
+try:
+    import curses
+except ImportError:
+    curses = None
+
+from sdb.incremental import IncrementalSearcher
+from sdb.folding import FoldedRecord, fold, match_positions
+from sdb.passwords import pretty_record
+
+ENTER = ('\n', '\r')
+BACKSPACE = ('\x7f', '\x08')
+ESCAPE = '\x1b'
+CTRL_C = '\x03'
+CTRL_N = '\x0e'
+CTRL_P = '\x10'
+CTRL_U = '\x15'
+
+if curses is not None:
+    KEY_UP, KEY_DOWN = curses.KEY_UP, curses.KEY_DOWN
+    KEY_PAGE_UP, KEY_PAGE_DOWN = curses.KEY_PPAGE, curses.KEY_NPAGE
+    KEY_ENTER, KEY_BACKSPACE = curses.KEY_ENTER, curses.KEY_BACKSPACE
+else:
+    KEY_UP, KEY_DOWN, KEY_PAGE_UP, KEY_PAGE_DOWN, KEY_ENTER, KEY_BACKSPACE = range(-6, 0)
+
+
+def describe(record):
+    """
+    Returns the line for record, and where its domain, username and notes
+    start in it.
+    """
+    prefix = ''
+    vault = getattr(record, 'vault', None)
+    if vault:
+        prefix = '[%s] ' % vault.name
+    # see pretty_record
+    starts = {1: len(prefix)}
+    starts[0] = starts[1] + len(record[1]) + len('@')
+    starts[3] = starts[0] + len(record[0]) + len(': ')
+    return prefix + pretty_record(record), starts
+
+
+class Picker(object):
+    def __init__(self, records, term=''):
+        self.searcher = IncrementalSearcher(FoldedRecord(record) for record in records)
+        self.term = ''
+        self.set_term(term)
+
+    def __len__(self):
+        return len(self.searcher)
+
+    def set_term(self, term):
+        self.term = term
+        self.searcher.set_term(fold(term)[0])
+        # the position of the highlighted match, and of the first one shown
+        self.selected = 0
+        self.offset = 0
+
+    def move(self, delta, height):
+        self.selected = max(0, min(self.selected + delta, len(self) - 1))
+        if self.selected < self.offset:
+            self.offset = self.selected
+        elif self.selected >= self.offset + height:
+            self.offset = self.selected - height + 1
+
+    def visible(self, height):
+        """
+        The matches that fit in height lines, without sorting the rest, as
+        FoldedRecords.
+        """
+        return self.searcher.results(self.offset + height)[self.offset:]
+
+    def highlights(self, folded):
+        """
+        Where the term matches in the line describe() gives for the
+        FoldedRecord folded.
+        """
+        starts = describe(folded.record)[1]
+        return [starts[k] + i for k, i in match_positions(self.searcher.term, folded)]
+
+    def choice(self):
+        if not len(self):
+            return None
+        return self.searcher.results(self.selected + 1)[self.selected].record
+
+    def key(self, key, height):
+        """
+        Handles a key press, when height matches fit on the screen. Returns
+        the chosen record once there is one, and raises KeyboardInterrupt if
+        the user gives up.
+        """
+        if key in ENTER or key == KEY_ENTER:
+            return self.choice()
+        elif key in (ESCAPE, CTRL_C):
+            raise KeyboardInterrupt
+        elif key in BACKSPACE or key == KEY_BACKSPACE:
+            self.set_term(self.term[:-1])
+        elif key == CTRL_U:
+            self.set_term('')
+        elif key in (KEY_UP, CTRL_P):
+            self.move(-1, height)
+        elif key in (KEY_DOWN, CTRL_N):
+            self.move(1, height)
+        elif key == KEY_PAGE_UP:
+            self.move(-height, height)
+        elif key == KEY_PAGE_DOWN:
+            self.move(height, height)
+        elif not isinstance(key, int) and key >= ' ':
+            self.set_term(self.term + key)
+        return None
+
+
+def draw(screen, picker):
+    height, width = screen.getmaxyx()
+    screen.erase()
+    status = '%d/%d' % (len(picker), len(picker.searcher.records))
+    screen.addnstr(0, 0, '> ' + picker.term, width - len(status) - 2)
+    screen.addnstr(0, width - len(status) - 1, status, len(status))
+    for i, folded in enumerate(picker.visible(height - 1)):
+        attr = curses.A_REVERSE if picker.offset + i == picker.selected else curses.A_NORMAL
+        screen.addnstr(i + 1, 0, describe(folded.record)[0], width - 1, attr)
+        for j in picker.highlights(folded):
+            if j < width - 1:
+                screen.chgat(i + 1, j, 1, attr | curses.A_BOLD)
+    screen.move(0, min(2 + len(picker.term), width - 1))
+    screen.refresh()
+
+
+def read_key(screen):
+    try:
+        return screen.get_wch()
+    except AttributeError:
+        # PY2
+        key = screen.getch()
+        if 0 <= key < 256:
+            return chr(key)
+        return key
+
+
+def run(screen, picker):
+    if hasattr(curses, 'set_escdelay'):
+        # don't wait a second to tell escape from the start of an arrow key
+        curses.set_escdelay(25)
+    while True:
+        draw(screen, picker)
+        height = screen.getmaxyx()[0] - 1
+        choice = picker.key(read_key(screen), height)
+        if choice is not None:
+            return choice
+
+
+def pick(picker):
+    """
+    Lets the user choose one of the records of the Picker picker, on the whole
+    terminal.
+    """
+    return curses.wrapper(run, picker)
@@ -0,0 +1,153 @@
+"""
+Random numbers for generating passwords.
+
+SystemRandom reads os.urandom for every number, and turns it into a float
+to pick from a sequence. RandomSource reads it a block at a time instead, and
+picks from a sequence of n things with the fewest bits that can count up to
+n, masked off a byte or a few, trying again if they come to n or more, so
+every index is equally likely. Up to 256 things a byte is enough, and up to
+65536, like the diceware words, two bytes; both are done a block at a time.
+
+The bytes are wiped from the pool as they're used, and the pool is thrown
+away after a fork, so parent and child don't both use the same bytes.
+"""
+import os
+import threading
+from array import array
+
+POOL_SIZE = 4096
+
+
+def wipe(buf):
+    """
+    Overwrites the bytearray buf with zeros, in place.
+    """
+    buf[:] = b'\0' * len(buf)
+
+
+def byte_tables(n):
+    """
+    The tables for bytearray.translate that turn bytes into indices below n,
+    n <= 256: the masked bytes, and the bytes to reject.
+    """
+    mask = (1 << (n - 1).bit_length()) - 1
+    table = bytes(bytearray(b & mask for b in range(256)))
+    reject = bytes(bytearray(b for b in range(256) if b & mask >= n))
+    return table, reject
+
+
+class RandomSource(object):
+    def __init__(self, pool_size=POOL_SIZE, urandom=os.urandom):
+        self.pool_size = pool_size
+        self.urandom = urandom
+        self.pool = bytearray()
+        # where the unused bytes of the pool start
+        self.position = 0
+        # the process that filled the pool
+        self.pid = None
+        self.lock = threading.Lock()
+        self.tables = {}
+
+    def read(self, n):
+        """
+        n random bytes, as a bytearray. They're wiped from the pool.
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.wipe()
+                self.pid = os.getpid()
+            result = bytearray()
+            while len(result) < n:
+                if self.position == len(self.pool):
+                    wipe(self.pool)
+                    self.pool = bytearray(self.urandom(max(self.pool_size, n - len(result))))
+                    self.position = 0
+                end = min(len(self.pool), self.position + n - len(result))
+                result += self.pool[self.position:end]
+                self.pool[self.position:end] = b'\0' * (end - self.position)
+                self.position = end
+            return result
+
+    def wipe(self):
+        """
+        Throws away what's left of the pool.
+        """
+        wipe(self.pool)
+        self.position = len(self.pool)
+
+    def below(self, n):
+        """
+        A random int from 0 up to, but not including, n.
+        """
+        bits = (n - 1).bit_length()
+        size = (bits + 7) // 8
+        mask = (1 << bits) - 1
+        while True:
+            buf = self.read(size)
+            i = 0
+            for b in buf:
+                i = i << 8 | b
+            wipe(buf)
+            i &= mask
+            if i < n:
+                return i
+
+    def indices(self, n, k):
+        """
+        k random ints below n, as a list.
+        """
+        if n > 65536:
+            return [self.below(n) for i in range(k)]
+        if n > 256:
+            return self.wide_indices(n, k)
+        try:
+            table, reject = self.tables[n]
+        except KeyError:
+            table, reject = self.tables[n] = byte_tables(n)
+        # how many of the 256 bytes are kept: more than half
+        accepted = 256 - len(reject)
+        result = bytearray()
+        while len(result) < k:
+            needed = k - len(result)
+            buf = self.read(needed * 256 // accepted + 8)
+            kept = buf.translate(table, reject)
+            result += kept
+            wipe(buf)
+            wipe(kept)
+        indices = list(result)[:k]
+        wipe(result)
+        return indices
+
+    def wide_indices(self, n, k):
+        """
+        indices() for 256 < n <= 65536, from two bytes at a time.
+        """
+        mask = (1 << (n - 1).bit_length()) - 1
+        result = []
+        while len(result) < k:
+            needed = k - len(result)
+            buf = self.read(2 * (needed * (mask + 1) // n + 8))
+            words = array('H')
+            try:
+                words.frombytes(buf)
+            except AttributeError:
+                # PY2
+                words.fromstring(bytes(buf))
+            result.extend(i for i in (word & mask for word in words) if i < n)
+            wipe(buf)
+            words[:] = array('H', [0]) * len(words)
+        del result[k:]
+        return result
+
+    def choice(self, seq):
+        return seq[self.below(len(seq))]
+
+    def choices(self, seq, k):
+        """
+        k random items of seq, which can repeat.
+        """
+        return [seq[i] for i in self.indices(len(seq), k)]
+
+
+# what gen_password() and friends use
+source = RandomSource()
@@ -0,0 +1,111 @@
+"""
+A sharded vault keeps its records in several separately encrypted segment
+files, so that changing a record only re-encrypts the segment it's in. The
+password file itself holds the manifest: the key used to pick a record's
+segment, the key the segments are encrypted with and the names of the
+current segment files.
+
+The segments are encrypted data packets under that key, without a key
+packet of their own, so only the password file needs a key derived from the
+password. Reading or writing any number of segments costs one S2K. Without
+in-process AES, the manifest has no such key, and the segments are
+encrypted with the password like the file is.
+
+Segments are never overwritten. A write puts the changed segments in new
+files, and then replaces the manifest, so a crash at any point leaves the
+old manifest and all of its segments intact.
+"""
+import os
+import hmac
+import hashlib
+import binascii
+
+from sdb.util import force_bytes
+
+
+SHARDS_MAGIC = b'\x00sdbs\n'
+
+
+def get_segment_prefix(filename):
+    file_parts = os.path.split(filename)
+    return '.' + file_parts[-1].lstrip('.') + '.shard-'
+
+
+def new_segment_name(filename, i):
+    return '%s%d-%s' % (
+        get_segment_prefix(filename),
+        i,
+        binascii.hexlify(os.urandom(6)).decode('ascii'),
+    )
+
+
+class Manifest(object):
+    def __init__(self, filename, key, segments, data_key=None):
+        self.filename = filename
+        self.key = key
+        self.segments = segments
+        # the AES-256 key of the segments. Manifests from before there was
+        # one have segments encrypted with the password.
+        self.data_key = data_key
+
+    @classmethod
+    def create(cls, filename, count, keyed=True):
+        """
+        A manifest for count new segments, with a key for them if keyed.
+        """
+        return cls(
+            filename, os.urandom(32), [new_segment_name(filename, i) for i in range(count)],
+            os.urandom(32) if keyed else None)
+
+    @classmethod
+    def decode(cls, filename, data):
+        lines = data.decode('ascii').split('\n')
+        keys = [binascii.unhexlify(key) for key in lines[0].split()]
+        return cls(filename, keys[0], [i for i in lines[1:] if i], *keys[1:])
+
+    def encode(self):
+        keys = [self.key] + ([self.data_key] if self.data_key else [])
+        lines = [' '.join(binascii.hexlify(key).decode('ascii') for key in keys)] + self.segments
+        return SHARDS_MAGIC + ('\n'.join(lines) + '\n').encode('ascii')
+
+    def path(self, i):
+        return os.path.join(os.path.dirname(self.filename), self.segments[i])
+
+    def shard(self, domain):
+        """
+        The segment records for domain belong in. It's a keyed hash, so the
+        segment files don't give away anything about the domains in them.
+        """
+        digest = hmac.new(self.key, force_bytes(domain), hashlib.sha256).hexdigest()
+        return int(digest, 16) % len(self.segments)
+
+    def partition(self, records):
+        parts = [[] for i in self.segments]
+        for record in records:
+            parts[self.shard(record[0])].append(record)
+        return parts
+
+    def replace(self, changed):
+        """
+        Returns a new manifest with new files for the segments in changed.
+        """
+        segments = list(self.segments)
+        for i in changed:
+            segments[i] = new_segment_name(self.filename, i)
+        return Manifest(self.filename, self.key, segments, self.data_key)
+
+
+def remove_unused_segments(filename, *manifests):
+    """
+    Removes segment files that none of manifests refer to. Those are left
+    behind by a failed write, or replaced by a write before the last one.
+    """
+    used = set()
+    for manifest in manifests:
+        if manifest:
+            used.update(manifest.segments)
+    prefix = get_segment_prefix(filename)
+    directory = os.path.dirname(filename) or '.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name not in used:
+            os.unlink(os.path.join(directory, name))
@@ -0,0 +1,88 @@
+"""
+Picks encryption settings for a vault by timing them on this machine, so that
+decrypting it takes about as long as a target: as long as can be tolerated,
+to make guessing the password as slow as possible.
+
+Most of the time goes to the S2K, which hashes the password over and over, so
+the S2K count is what gets tuned. The cipher and compression are whichever
+are fastest for the vault, to leave as much of the time as possible to the
+S2K.
+"""
+import os
+import time
+import binascii
+
+from sdb import openpgp
+
+
+CIPHERS = ['AES256', 'AES']
+DIGESTS = ['SHA512', 'SHA256']
+COMPRESSIONS = ['none', 'zip', 'zlib']
+
+# gpg won't use less than this
+MIN_S2K_COUNT = 65536
+MAX_S2K_COUNT = 65011712
+# big enough that hashing takes much longer than everything else
+PROBE_S2K_COUNT = 8 * 1024 * 1024
+
+
+def largest_s2k_count(count):
+    """
+    The largest S2K count that can be encoded that is at most count, and at
+    least MIN_S2K_COUNT.
+    """
+    c = openpgp.encode_s2k_count(max(MIN_S2K_COUNT, min(count, MAX_S2K_COUNT)))
+    if openpgp.decode_s2k_count(c) > count and openpgp.decode_s2k_count(c - 1) >= MIN_S2K_COUNT:
+        c -= 1
+    return openpgp.decode_s2k_count(c)
+
+
+def time_decrypt(backend, plaintext, settings, armor=True, repeat=3):
+    """
+    The fastest of repeat decryptions of plaintext encrypted with settings.
+    """
+    password = binascii.hexlify(os.urandom(8)).decode('ascii')
+    ciphertext = backend.encrypt(password, plaintext, armor, settings)
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        backend.decrypt(password, ciphertext)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def tune(backend, plaintext, target=.15, armor=True, repeat=3, report=None):
+    """
+    Returns the settings that make decrypting plaintext with backend take
+    about target seconds, and how long it takes with them. report is called
+    with a line of text for each measurement.
+    """
+    report = report or (lambda line: None)
+    settings = {'s2k_count': MIN_S2K_COUNT, 'digest': DIGESTS[0]}
+
+    best = None
+    for cipher in CIPHERS:
+        for compression in COMPRESSIONS:
+            settings.update(cipher=cipher, compression=compression)
+            seconds = time_decrypt(backend, plaintext, settings, armor, repeat)
+            report('%-7s %-5s %8.1f ms' % (cipher, compression, seconds * 1000))
+            # the first ones are preferred, unless the others are clearly faster
+            if best is None or seconds < best[0] * .9:
+                best = (seconds, cipher, compression)
+    settings['cipher'], settings['compression'] = best[1:]
+
+    best = None
+    for digest in DIGESTS:
+        settings.update(digest=digest, s2k_count=MIN_S2K_COUNT)
+        low = time_decrypt(backend, plaintext, settings, armor, repeat)
+        settings['s2k_count'] = PROBE_S2K_COUNT
+        high = time_decrypt(backend, plaintext, settings, armor, repeat)
+        per_byte = max(high - low, 1e-9) / (PROBE_S2K_COUNT - MIN_S2K_COUNT)
+        count = largest_s2k_count(MIN_S2K_COUNT + int((target - low) / per_byte))
+        report('%-13s %8.1f ms per million S2K bytes, count %d' % (digest, per_byte * 1e9, count))
+        if best is None or count > best[0]:
+            best = (count, digest)
+    settings['s2k_count'], settings['digest'] = best
+
+    seconds = time_decrypt(backend, plaintext, settings, armor, repeat)
+    return settings, seconds
@@ -0,0 +1,105 @@
+"""
+Scoring a term against all the records at once with numpy, for running lots
+of searches against the same records.
+
+The searched text of each record is a row of code points in a matrix, padded
+with PADDING, which isn't a code point. match() goes through the term a
+character at a time, finding the next occurrence of it in the text; here that
+step is done for every row at once, and the scores are added up in the same
+order as match() does, so they come out exactly the same.
+
+Records are grouped by the length of their text, so one long note doesn't
+make the whole matrix as wide as it is.
+
+Without numpy, BulkSearcher does the same thing with match().
+"""
+from operator import itemgetter
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sdb.passwords import record_score
+from sdb.index import haystack
+
+PADDING = 0xffffffff
+
+
+def code_points(text):
+    if isinstance(text, bytes) and bytes is not str:
+        # a str never matches bytes, but still matches an empty term
+        return []
+    return [ord(c) for c in text]
+
+
+class BulkSearcher(object):
+    def __init__(self, records, use_numpy=True):
+        self.records = list(records)
+        self.use_numpy = use_numpy and numpy is not None
+        if self.use_numpy:
+            self.groups = self.make_groups()
+
+    def make_groups(self):
+        """
+        Returns (ids, matrix) for each group of records whose texts have
+        about the same length.
+        """
+        by_width = {}
+        texts = []
+        for i, record in enumerate(self.records):
+            text = code_points(haystack(record))
+            texts.append(text)
+            width = 1
+            while width < len(text):
+                width *= 2
+            by_width.setdefault(width, []).append(i)
+        groups = []
+        for width, ids in sorted(by_width.items()):
+            matrix = numpy.full((len(ids), width), PADDING, dtype=numpy.uint32)
+            for row, i in enumerate(ids):
+                matrix[row, :len(texts[i])] = texts[i]
+            groups.append((numpy.array(ids, dtype=numpy.intp), matrix))
+        return groups
+
+    def scores(self, term):
+        """
+        The score of each record for term, as record_score would give it.
+        """
+        if not self.use_numpy:
+            return [record_score(term, record) for record in self.records]
+        scores = numpy.zeros(len(self.records))
+        for ids, matrix in self.groups:
+            scores[ids] = self.group_scores(term, matrix)
+        return scores
+
+    def group_scores(self, term, matrix):
+        count, width = matrix.shape
+        rows = numpy.arange(count)
+        positions = numpy.arange(width)
+        score = numpy.ones(count)
+        alive = numpy.ones(count, dtype=bool)
+        start = numpy.zeros(count, dtype=numpy.intp)
+        last_match = numpy.zeros(count)
+        for c in term:
+            found = (matrix == ord(c)) & (positions >= start[:, numpy.newaxis])
+            j = found.argmax(axis=1)
+            alive &= found[rows, j]
+            score[alive] += 1 / (last_match[alive] + 1.)
+            last_match = j.astype(float)
+            start = j + 1
+        score[~alive] = 0
+        return score
+
+    def search(self, term):
+        """
+        The same as search(term, records).
+        """
+        scores = self.scores(term)
+        if not self.use_numpy:
+            results = [(score, i) for i, score in enumerate(scores) if score]
+            results.sort(key=itemgetter(0), reverse=True)
+            return [self.records[i] for score, i in results]
+        matches = numpy.flatnonzero(scores)
+        order = numpy.argsort(-scores[matches], kind='stable')
+        return [self.records[i] for i in matches[order]]
@@ -30,10 +30,12 @@ setup(name='sdb',
     author_email='gavinwahl@gmail.com',
     long_description=__doc__,
     packages=['sdb'],
+    package_data={'sdb': ['diceware.words']},
     scripts=['sdb/sdb'],
     platforms = "any",
     license='BSD',
     test_suite='nose.collector',
     install_requires=install_requires,
+    extras_require={'fast': ['cryptography']},
     setup_requires = ['nose', 'pytest'] + install_requires,
 )
@@ -0,0 +1,130 @@
+import os
+import stat
+import threading
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from unittest import TestCase
+
+import pytest
+
+from sdb.passwords import InteractiveSession, get_socket_file, pack
+from sdb.daemon import *
+
+from test_passwords import Empty, unused_filename
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.filename = unused_filename()
+        self.args = Empty(file=self.filename)
+
+        session = InteractiveSession(self.args, password='asdf')
+        session.edit_transaction(lambda records: [('domain.com', 'username', 'password', '')])
+
+        self.daemon = Daemon(InteractiveSession(self.args, password='asdf'), timeout=5)
+        s = self.daemon.bind()
+        self.thread = threading.Thread(target=self.daemon.serve, args=(s,))
+        self.thread.start()
+
+    def tearDown(self):
+        client = connect(self.filename)
+        if client:
+            client.lock()
+        self.thread.join()
+        try:
+            os.unlink(self.filename)
+        except OSError:
+            pass
+
+    def session(self, input=''):
+        return InteractiveSession(
+            self.args,
+            input=StringIO(input),
+            output=StringIO(),
+            daemon=connect(self.filename),
+        )
+
+    def test_permissions(self):
+        mode = os.stat(get_socket_file(self.filename)).st_mode
+        assert stat.S_IMODE(mode) == 0o600
+
+    def test_untrusted_socket(self):
+        socket_file = get_socket_file(self.filename)
+        assert connect(self.filename)
+        # one that others could use, or that isn't a socket, could be anyone's
+        os.chmod(socket_file, 0o666)
+        try:
+            assert connect(self.filename) is None
+        finally:
+            os.chmod(socket_file, 0o600)
+        assert not is_own_socket(self.filename)
+
+    def test_read(self):
+        session = self.session()
+        assert session.password is None
+        assert session.read_records() == [('domain.com', 'username', 'password', '')]
+
+    def test_write(self):
+        self.args.domain = 'other.com'
+        self.session('user\npw\nnotes\n').add_action()
+
+        expected = [
+            ('domain.com', 'username', 'password', ''),
+            ('other.com', 'user', 'pw', 'notes'),
+        ]
+        assert self.session().read_records() == expected
+        # it was written to the file too
+        session = InteractiveSession(self.args, password='asdf')
+        assert session.read_records() == expected
+
+    def test_conflict(self):
+        client = connect(self.filename)
+        current = client.read()
+        client.write(current, pack([('a', 'b', 'c', 'd')]))
+        with pytest.raises(ConflictError):
+            client.write(current, pack([('e', 'f', 'g', 'h')]))
+        assert decode(client.read()) == [('a', 'b', 'c', 'd')]
+
+    def test_file_changed(self):
+        session = InteractiveSession(self.args, password='asdf')
+        session.edit_transaction(lambda records: records + [('new.com', 'u', 'p', '')])
+        assert len(self.session().read_records()) == 2
+
+    def test_search(self):
+        client = connect(self.filename)
+        assert decode(client.search('dom')) == [('domain.com', 'username', 'password', '')]
+        assert decode(client.search('nothing')) == []
+        assert decode(client.search(u'D\u00d3M')) == decode(client.search('dom'))
+
+        # the index is rebuilt after a write
+        self.args.domain = 'domain2.com'
+        self.session('user\npw\n\n').add_action()
+        assert len(decode(client.search('dom'))) == 2
+
+        self.args.domain = 'domain2'
+        assert self.session().show_action(clipboard=False) == 'pw'
+
+    def test_search_mixed(self):
+        # bytes and text in one record don't break the index
+        self.session().edit_transaction(lambda records: records + [('data.com', b'user', b'pw', '')])
+        client = connect(self.filename)
+        assert decode(client.search('domain')) == [('domain.com', 'username', 'password', '')]
+        assert decode(client.search('data')) == [('data.com', b'user', b'pw', '')]
+
+    def test_lock(self):
+        connect(self.filename).lock()
+        self.thread.join()
+        assert not os.path.exists(get_socket_file(self.filename))
+        assert connect(self.filename) is None
+        assert self.daemon.records is None
+        assert self.daemon.session.password is None
+
+
+def test_idle_timeout():
+    filename = unused_filename()
+    daemon = Daemon(InteractiveSession(Empty(file=filename), password='asdf'), timeout=.1)
+    daemon.serve()
+    assert not os.path.exists(get_socket_file(filename))
+    assert daemon.session.password is None
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from sdb.diceware import *
+
+
+def test_words():
+    assert len(WORDS) == 7776
+    assert WORDS[0] == 'a'
+    assert WORDS[1] == 'a&p'
+    assert WORDS[-1] == '@'
+    assert WORDS[-2:] == ['??', '@']
+    assert len(set(WORDS)) == 7776
+    assert all(word and word.strip() == word for word in WORDS)
+    with pytest.raises(IndexError):
+        WORDS[7776]
+
+
+def test_lazy():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return b'one\ntwo\nthr\xc3\xa9e'
+    words = WordList(load)
+    assert loads == []
+    assert words[2] == u'thrée'
+    assert len(words) == 3
+    assert list(words) == [u'one', u'two', u'thrée']
+    assert loads == [1]
+    assert len(WordList(lambda: b'')) == 0
+
+
+def test_pack_words():
+    eff = b'11111\tabacus\n11112\tabdomen\n\n# a comment\n11113\tabacus\n11114 zebra\r\n'
+    assert pack_words(eff) == b'abacus\nabdomen\nzebra\n'
+    with pytest.raises(ValueError):
+        pack_words(b'11111 same\n11112 same\n')
+
+
+class TestWordListFile(object):
+    def setup_method(self, method):
+        self.dir = tempfile.mkdtemp()
+        self.cache = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = os.path.join(self.dir, 'cache')
+        self.filename = os.path.join(self.dir, 'eff.txt')
+        with open(self.filename, 'wb') as f:
+            f.write(b'11111\tabacus\n11112\tabdomen\n11113\tabdominal\n')
+
+    def teardown_method(self, method):
+        if self.cache is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self.cache
+        shutil.rmtree(self.dir)
+
+    def test_load(self):
+        words = load_word_list(self.filename)
+        assert list(words) == ['abacus', 'abdomen', 'abdominal']
+        cached = os.listdir(get_cache_dir())
+        assert len(cached) == 1
+
+        # the second time, it comes from the cache
+        with open(os.path.join(get_cache_dir(), cached[0]), 'wb') as f:
+            f.write(b'from\ncache\n')
+        assert list(load_word_list(self.filename)) == ['from', 'cache']
+
+        # and a changed file is parsed again
+        with open(self.filename, 'ab') as f:
+            f.write(b'11114\tabide\n')
+        assert len(load_word_list(self.filename)) == 4
@@ -0,0 +1,109 @@
+import os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from unittest import TestCase
+from tempfile import NamedTemporaryFile
+
+from sdb.passwords import InteractiveSession, VaultRecord
+from sdb.federation import *
+from sdb.config import read_vaults
+
+from test_passwords import Empty, unused_filename
+
+
+VAULTS = {
+    'personal': [('mail.com', 'me', 'pw1', ''), ('bank.com', 'me', 'pw2', '')],
+    'team': [('mail.com', 'team', 'pw3', ''), ('ci.com', 'bot', 'pw4', '')],
+}
+
+
+class TestFederation(TestCase):
+    def setUp(self):
+        self.files = {}
+        for name, records in VAULTS.items():
+            filename = unused_filename()
+            self.files[name] = filename
+            session = InteractiveSession(Empty(file=filename), password=name)
+            session.edit_transaction(lambda current: list(records))
+
+    def tearDown(self):
+        for filename in self.files.values():
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+
+    def federation(self, input='', domain=None):
+        self.output = StringIO()
+        input = StringIO(input)
+        sessions = [
+            InteractiveSession(
+                Empty(file=self.files[name], name=name, domain=domain),
+                input=input, output=self.output, password=name)
+            for name in ['personal', 'team']
+        ]
+        return Federation(sessions)
+
+    def test_wrong_password(self):
+        self.output = StringIO()
+        input = StringIO('personal\n')
+        sessions = [
+            InteractiveSession(
+                Empty(file=self.files[name], name=name),
+                input=input, output=self.output, password=password)
+            for name, password in [('personal', 'wrong'), ('team', 'team')]
+        ]
+        records = Federation(sessions).read_records()
+        assert records == VAULTS['personal'] + VAULTS['team']
+        assert self.output.getvalue() == 'Password: '
+        assert sessions[0].password_lock is sessions[1].password_lock
+
+    def records(self, name):
+        return InteractiveSession(Empty(file=self.files[name]), password=name).read_records()
+
+    def test_read(self):
+        records = self.federation().read_records()
+        assert records == VAULTS['personal'] + VAULTS['team']
+        assert [r.vault.name for r in records] == ['personal', 'personal', 'team', 'team']
+
+    def test_show(self):
+        federation = self.federation('1\n', domain='mail')
+        assert federation.show_action(clipboard=False) == 'pw3'
+        assert "0) [personal] ('mail.com', 'me')" in self.output.getvalue()
+        assert "1) [team] ('mail.com', 'team')" in self.output.getvalue()
+
+        assert self.federation(domain='ci').show_action(clipboard=False) == 'pw4'
+
+    def test_edit(self):
+        self.federation('\n\nnewpw\n\n', domain='ci').edit_action()
+        assert self.records('team') == [('mail.com', 'team', 'pw3', ''), ('ci.com', 'bot', 'newpw', '')]
+        assert self.records('personal') == VAULTS['personal']
+
+    def test_delete(self):
+        self.federation('0\ny\n', domain='mail').delete_action()
+        assert self.records('personal') == [('bank.com', 'me', 'pw2', '')]
+        assert self.records('team') == VAULTS['team']
+
+    def test_add(self):
+        federation = self.federation('u\np\n\n', domain='new.com')
+        federation.add_action()
+        assert self.records('personal')[-1] == ('new.com', 'u', 'p', '')
+
+
+def test_vault_record():
+    record = VaultRecord(('a', 'b', 'c', 'd'), 'vault')
+    assert record == ('a', 'b', 'c', 'd')
+    assert record.vault == 'vault'
+
+
+def test_read_vaults():
+    with NamedTemporaryFile('w') as f:
+        f.write('[vaults]\npersonal = ~/.passwords\nteam = /srv/team\n')
+        f.flush()
+        assert read_vaults(f.name) == [
+            ('personal', os.path.expanduser('~/.passwords')),
+            ('team', '/srv/team'),
+        ]
+    assert read_vaults('/nonexistent') == []
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from sdb.passwords import search, search_folded
+from sdb.folding import *
+
+
+def test_fold():
+    assert fold(u'GitHub') == (u'github', None)
+    assert fold(u'GítHüb') == (u'github', None)
+    # decomposed, the accent is a character of its own
+    assert fold(u'GítHüb') == (u'github', [0, 1, 3, 4, 5, 7])
+    assert fold(u'Straße') == (u'strasse', [0, 1, 2, 3, 4, 4, 5])
+    assert fold(u'Ｇit') == (u'git', None)
+    assert fold(b'GitHub') == (b'GitHub', None)
+
+
+def test_folded_record():
+    record = (u'Straße.DE', u'Me', u'secret', u'NOTES')
+    folded = FoldedRecord(record)
+    assert folded == (u'strasse.de', u'me', u'', u'notes')
+    assert folded.record is record
+    assert folded.positions == ([0, 1, 2, 3, 4, 4, 5, 6, 7, 8], None, None)
+    assert match_positions(u'assme', folded) == [(0, 3), (0, 4), (0, 4), (1, 0), (1, 1)]
+    assert match_positions(u'enot', folded) == [(0, 5), (3, 0), (3, 1), (3, 2)]
+    assert match_positions(u'x', folded) == []
+    assert match_positions(u'a', FoldedRecord((b'a', b'b', b'c', b'd'))) == []
+
+
+def test_search_folded():
+    records = [
+        (u'GitHub.com', u'me', u'pw', u''),
+        (u'gítlab.com', u'me', u'pw', u''),
+        (u'example.com', u'ME', u'pw', u'GIT'),
+        (b'github.com', b'me', b'pw', b''),
+    ]
+    assert search_folded(u'git', records) == [records[0], records[1], records[2]]
+    assert search_folded(u'GÍT', records) == search_folded(u'git', records)
+    assert search_folded(u'GITL', records, 1) == [records[1]]
+    # the same scores as search() of the folded text
+    lowered = [tuple(field.lower() for field in record) for record in records[:3]]
+    assert search_folded(u'mecom', records) == [records[i] for i in map(lowered.index, search(u'mecom', lowered))]
+    folded = [FoldedRecord(record) for record in records]
+    assert search_folded(u'git', folded) == search_folded(u'git', records)
@@ -0,0 +1,54 @@
+from sdb.passwords import search
+from sdb.incremental import *
+
+from test_index import random_records, MIXED
+
+
+def test_typing():
+    records = random_records(2000)
+    searcher = IncrementalSearcher(records)
+    assert searcher.results() == search('', records)
+    for term in ['a', 'ab', 'abc', 'abc.', 'abc', 'ab', 'a', '']:
+        searcher.set_term(term)
+        assert searcher.term == term
+        assert searcher.results() == search(term, records)
+        assert searcher.results(5) == search(term, records)[:5]
+        assert len(searcher) == len(search(term, records))
+
+
+def test_append_backspace():
+    records = [
+        ('github.com', 'me', 'pw', ''),
+        ('gitlab.com', 'me', 'pw', ''),
+        ('google.com', 'me', 'pw', ''),
+    ]
+    searcher = IncrementalSearcher(records)
+    for c in 'git':
+        searcher.append(c)
+    assert searcher.results() == search('git', records)
+    assert len(searcher) == 2
+    searcher.backspace()
+    searcher.backspace()
+    assert searcher.term == 'g'
+    assert len(searcher) == 3
+    searcher.set_term('gol')
+    assert searcher.results() == search('gol', records)
+    # backspace on nothing does nothing
+    searcher.set_term('')
+    searcher.backspace()
+    assert searcher.term == ''
+    assert len(searcher) == 3
+
+
+def test_bytes():
+    records = [(b'a.com', b'user', b'pw', b''), ('a.com', 'user', 'pw', '')]
+    searcher = IncrementalSearcher(records)
+    searcher.set_term('a')
+    assert searcher.results() == search('a', records)
+
+
+def test_mixed():
+    searcher = IncrementalSearcher(MIXED)
+    for term in ['a', 'ab', 'a', '', 'au', 'an']:
+        searcher.set_term(term)
+        assert searcher.results() == search(term, MIXED)
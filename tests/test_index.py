@@ -0,0 +1,72 @@
+import random
+
+from sdb.passwords import search
+from sdb.index import *
+
+
+def random_records(n, alphabet='abcde.xyzABC\xe9'):
+    rng = random.Random(n)
+    records = set()
+    while len(records) < n:
+        records.add(tuple(
+            ''.join(rng.choice(alphabet) for i in range(rng.randint(0, 8)))
+            for j in range(4)
+        ))
+    return sorted(records)
+
+
+def test_iter_bits():
+    assert list(iter_bits(0)) == []
+    assert list(iter_bits(0b1011)) == [0, 1, 3]
+    assert list(iter_bits(1 << 100)) == [100]
+
+
+def test_same_as_search():
+    records = random_records(2000)
+    index = SearchIndex(records)
+    for term in ['', 'a', 'ab', 'aab', 'xyz', '\xe9.', 'q', 'aaaaaaaa', 'ABe', 'cba']:
+        assert index.search(term) == search(term, records)
+
+
+def test_candidates():
+    records = [
+        ('abc.com', 'user', 'pw', ''),
+        ('xyz.com', 'user', 'pw', 'notes'),
+        ('cab.com', 'other', 'pw', ''),
+    ]
+    index = SearchIndex(records)
+    assert list(index.candidates('ab')) == [0, 2]
+    # passwords aren't searched
+    assert list(index.candidates('p')) == []
+    assert list(index.candidates('q')) == []
+    assert list(index.candidates('')) == [0, 1, 2]
+    # candidates only have the characters; it takes match() to check the order
+    assert list(index.candidates('ba')) == [0, 2]
+    assert index.search('ba') == []
+
+
+def test_empty():
+    index = SearchIndex([])
+    assert index.search('') == []
+    assert index.search('a') == []
+
+
+MIXED = [
+    ('a.com', b'user', b'pw', b''),
+    (b'a.com', 'user', 'pw', 'a'),
+    ('ab.com', 'user', 'pw', b'notes'),
+    ('a.com', 'user', 'pw', ''),
+]
+
+
+def test_haystack():
+    assert haystack(('a.com', 'user', 'pw', 'notes')) == 'a.comusernotes'
+    # as far as record_score gets with bytes and text mixed
+    assert haystack(MIXED[0]) == 'a.com'
+    assert haystack(MIXED[2]) == 'ab.comuser'
+
+
+def test_mixed():
+    index = SearchIndex(MIXED)
+    for term in ['', 'a', 'ab', 'au', 'an', 'x']:
+        assert index.search(term) == search(term, MIXED)
@@ -0,0 +1,64 @@
+import os
+import ast
+import random
+
+import pytest
+
+from sdb.literal import *
+from sdb.passwords import encode, decode
+
+
+def random_text(n=30):
+    # lots of the characters repr() has to escape, and some it doesn't
+    interesting = u'\'"\\\n\r\t\x00\x7f\xa0\xe9 abc \ud800\U0001f600'
+    chars = []
+    for i in range(random.randint(0, n)):
+        if random.random() < .5:
+            chars.append(random.choice(interesting))
+        else:
+            chars.append(unichr(random.randint(0, 0x3000)))
+    return u''.join(chars)
+
+
+def random_field():
+    if random.random() < .5:
+        return random_text()
+    return os.urandom(random.randint(0, 30))
+
+
+def test_parse_like_literal_eval():
+    for i in range(2000):
+        record = tuple(random_field() for i in range(random.randint(1, 5)))
+        line = repr(record)
+        assert parse_tuple(line) == record
+        assert parse_tuple(line) == ast.literal_eval(line)
+
+
+def test_encode_decode():
+    for i in range(100):
+        records = [tuple(random_field() for i in range(4)) for i in range(10)]
+        assert decode(encode(records)) == records
+
+
+@pytest.mark.parametrize('line', [
+    "('a')",
+    "()",
+    "('a' 'b',)",
+    "('a', 1)",
+    "(rb'x',)",
+    "('\\101',)",
+    "('\\N{BULLET}',)",
+    "('a',  'b')",
+    "[]",
+])
+def test_fall_back(line):
+    with pytest.raises(UnsupportedLiteral):
+        parse_tuple(line)
+    assert literal_eval(line) == ast.literal_eval(line)
+
+
+def test_invalid():
+    with pytest.raises(SyntaxError):
+        literal_eval("('a', 'b'")
+    with pytest.raises(SyntaxError):
+        literal_eval("(b'\xe9',)")
@@ -0,0 +1,192 @@
+import io
+import os
+import struct
+import hashlib
+import subprocess
+from tempfile import TemporaryFile
+
+import pytest
+
+from sdb.openpgp import *
+from sdb.openpgp import PurePythonAES, decode_s2k_count, encode_s2k_count
+from sdb import openpgp, passwords
+
+
+def gpg(args, password, data):
+    # through files, so big inputs can't fill up a pipe
+    with TemporaryFile() as stdin:
+        with TemporaryFile() as stdout:
+            stdin.write(password + b'\n' + data)
+            stdin.seek(0)
+            subprocess.check_call(
+                ['gpg', '--passphrase-fd', '0', '--batch'] + args,
+                stdin=stdin, stdout=stdout, stderr=subprocess.PIPE,
+            )
+            stdout.seek(0)
+            return stdout.read()
+
+
+# sizes around the partial body length boundaries, and big enough to need them
+SIZES = [0, 1, 191, 192, 8383, 8384, 70000]
+
+
+def test_aes():
+    # FIPS-197, appendix C
+    plaintext = struct.unpack('>4I', bytes(bytearray.fromhex('00112233445566778899aabbccddeeff')))
+    for key, expected in [
+        ('000102030405060708090a0b0c0d0e0f', '69c4e0d86a7b0430d8cdb78070b4c55a'),
+        ('000102030405060708090a0b0c0d0e0f1011121314151617', 'dda97ca4864cdfe06eaf70a0ec0d7191'),
+        ('000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f', '8ea2b7ca516745bfeafc49904b496089'),
+    ]:
+        aes = PurePythonAES(bytes(bytearray.fromhex(key)))
+        assert struct.pack('>4I', *aes.encrypt_block(*plaintext)) == bytes(bytearray.fromhex(expected))
+
+
+def test_s2k_count():
+    assert decode_s2k_count(0) == 1024
+    assert decode_s2k_count(255) == 65011712
+    for c in range(256):
+        assert encode_s2k_count(decode_s2k_count(c)) == c
+    # rounds up to the next count that can be encoded
+    assert decode_s2k_count(encode_s2k_count(1025)) >= 1025
+
+
+def test_armor():
+    for size in SIZES:
+        data = os.urandom(size)
+        assert dearmor(armor(data)) == data
+    armored = armor(b'some data')
+    with pytest.raises(CorruptData):
+        dearmor(armored.replace(b'c29t', b'c29u'))
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_gpg_decrypts(size):
+    data = os.urandom(size)
+    assert gpg(['-d'], b'pw', encrypt(b'pw', data)) == data
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_decrypts_gpg(size):
+    data = os.urandom(size)
+    encrypted = gpg(['-c', '--armor', '--cipher-algo', 'AES', '--digest-algo', 'SHA256'], b'pw', data)
+    assert decrypt(b'pw', encrypted) == data
+
+
+@pytest.mark.parametrize('options', [
+    dict(cipher='AES192', digest='SHA1', compression='none', armored=False),
+    dict(cipher='AES256', digest='SHA512', compression='zlib'),
+    dict(cipher='AES', digest='SHA256', compression='bzip2', s2k_count=1024),
+])
+def test_options(options):
+    data = b'a' * 10000
+    assert gpg(['-d'], b'pw', encrypt(b'pw', data, **options)) == data
+    assert decrypt(b'pw', encrypt(b'pw', data, **options)) == data
+
+
+@pytest.mark.parametrize('args', [
+    ['--cipher-algo', 'AES256', '--compress-algo', 'none'],
+    ['--cipher-algo', 'AES192', '--compress-algo', 'zlib', '--s2k-digest-algo', 'SHA512'],
+    ['--compress-algo', 'bzip2', '--s2k-count', '1024'],
+])
+def test_gpg_options(args):
+    data = b'a' * 10000
+    assert decrypt(b'pw', gpg(['-c'] + args, b'pw', data)) == data
+
+
+def test_errors():
+    encrypted = encrypt(b'pw', b'data', armored=False, s2k_count=1024)
+    with pytest.raises(BadPassphrase):
+        decrypt(b'wrong', encrypted)
+
+    flipped = bytearray(encrypted)
+    flipped[-5] ^= 1
+    with pytest.raises(CorruptData):
+        decrypt(b'pw', bytes(flipped))
+
+    with pytest.raises(NoData):
+        decrypt(b'pw', b'not encrypted')
+
+    for length in range(len(encrypted)):
+        with pytest.raises(OpenPGPError):
+            decrypt(b'pw', encrypted[:length])
+
+
+def test_encrypt_digest(monkeypatch):
+    for armored in (True, False):
+        encrypted, digest = encrypt_digest(b'pw', b'data', armored=armored, s2k_count=1024)
+        assert digest == hashlib.sha256(b'data').digest()
+        assert decrypt(b'pw', encrypted) == b'data'
+    # gpg's output is decrypted again
+    encrypted, digest = passwords.SubprocessBackend().encrypt_digest('pw', b'data')
+    assert digest == hashlib.sha256(b'data').digest()
+
+    # the digest is of what the output decrypts to, not of the input
+    real_cfb_encrypt = openpgp.cfb_encrypt
+
+    def cfb_encrypt(key, data):
+        flipped = bytearray(real_cfb_encrypt(key, data))
+        flipped[-30] ^= 1
+        return bytes(flipped)
+    monkeypatch.setattr(openpgp, 'cfb_encrypt', cfb_encrypt)
+    with pytest.raises(CorruptData):
+        encrypt_digest(b'pw', b'data', s2k_count=1024)
+    with pytest.raises(passwords.FileCorruptionException):
+        passwords.OpenPGPBackend().encrypt_digest('pw', b'data')
+
+
+def test_unsupported():
+    encrypted = gpg(['-c', '--cipher-algo', 'CAST5'], b'pw', b'data')
+    with pytest.raises(Unsupported):
+        decrypt(b'pw', encrypted)
+    # the backend lets gpg handle it
+    assert passwords.OpenPGPBackend().decrypt('pw', encrypted) == b'data'
+
+
+def test_backend_exceptions():
+    backend = passwords.OpenPGPBackend()
+    encrypted = backend.encrypt('pw', b'data')
+    assert backend.decrypt('pw', encrypted) == b'data'
+    with pytest.raises(passwords.IncorrectPasswordException):
+        backend.decrypt('wrong', encrypted)
+    with pytest.raises(passwords.InvalidEncryptedFileException):
+        backend.decrypt('pw', b'not encrypted')
+
+
+def test_slow_fallback(monkeypatch):
+    monkeypatch.setattr(openpgp, 'FAST', False)
+    backend = passwords.OpenPGPBackend()
+    data = b'a' * (backend.SLOW_LIMIT + 1)
+    assert backend.use_fallback(data)
+    assert not backend.use_fallback(data[:-1])
+    assert backend.decrypt('pw', backend.encrypt('pw', data)) == data
+
+
+def test_stream_fallback(monkeypatch):
+    # even when cryptography is fast, a big file isn't read all at once
+    monkeypatch.setattr(openpgp, 'FAST', True)
+    backend = passwords.OpenPGPBackend()
+    backend.STREAM_LIMIT = 1024
+    data = os.urandom(2048)
+    with TemporaryFile() as f:
+        f.write(backend.fallback.encrypt('pw', data, armor=False))
+        f.seek(0)
+        with backend.decrypt_stream('pw', f) as plaintext:
+            assert not isinstance(plaintext, io.BytesIO)
+            assert plaintext.read() == data
+
+
+def test_get_backend(monkeypatch):
+    monkeypatch.delenv('SDB_BACKEND', raising=False)
+    # the pure python AES only when it's asked for
+    monkeypatch.setattr(openpgp, 'FAST', True)
+    assert isinstance(passwords.get_backend(), passwords.OpenPGPBackend)
+    assert passwords.in_process_aes()
+    monkeypatch.setattr(openpgp, 'FAST', False)
+    assert isinstance(passwords.get_backend(), passwords.SubprocessBackend)
+    assert not passwords.in_process_aes()
+    monkeypatch.setenv('SDB_BACKEND', 'gpg')
+    assert isinstance(passwords.get_backend(), passwords.SubprocessBackend)
+    monkeypatch.setenv('SDB_BACKEND', 'openpgp')
+    assert isinstance(passwords.get_backend(), passwords.OpenPGPBackend)
+    assert passwords.in_process_aes()
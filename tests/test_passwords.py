@@ -1,17 +1,40 @@
 import os
+import math
 import random
+import threading
+import string
+import binascii
+import itertools
 try:
     from StringIO import StringIO
     BytesIO = StringIO
 except ImportError:
     from io import StringIO, BytesIO
 from unittest import TestCase
+from contextlib import contextmanager
 from tempfile import NamedTemporaryFile
+from random import Random
 
 import pytest
 
 from sdb.passwords import *
 
+@contextmanager
+def use_backend(name):
+    """
+    Sets $SDB_BACKEND to name for the duration.
+    """
+    old = os.environ.get('SDB_BACKEND')
+    os.environ['SDB_BACKEND'] = name
+    try:
+        yield
+    finally:
+        if old is None:
+            del os.environ['SDB_BACKEND']
+        else:
+            os.environ['SDB_BACKEND'] = old
+
+
 def random_str(n=1000):
     return os.urandom(random.randint(0, n))
 
@@ -25,6 +48,63 @@ def test_encode_decode():
 
     assert [] == decode(encode([]))
 
+def test_pack():
+    for i in range(25):
+        records = [random_tuple(4) for i in range(10)]
+        records.append((u'text \u2603', b'bytes', u'', b''))
+        assert records == decode(pack(records))
+        assert records == list(iter_decode(BytesIO(pack(records))))
+
+    assert pack([]) == PACKED_MAGIC
+    assert [] == decode(pack([]))
+
+    # cut off anywhere, in the headers as well as the fields
+    data = pack([('a', 'b', 'c', 'd')])
+    for end in range(len(PACKED_MAGIC) + 1, len(data)):
+        with pytest.raises(ValueError):
+            decode(data[:end])
+
+def test_pack_columns():
+    records = [
+        (u'google.com', u'username', u'password', u'lorem ipsum dolor sit amet'),
+        (u'github.com', u'username', u'passw\u00f6rd', u'social code'),
+        (u'foo.com', u'afaf', u'', u''),
+    ]
+    data = pack_columns(records)
+    assert data.startswith(COLUMNS_MAGIC)
+    assert decode(data) == records
+    # usernames are only stored once
+    assert data.count(b'username') == 1
+
+    columns = Columns(data[len(COLUMNS_MAGIC):])
+    assert len(columns) == 3
+    assert columns.partial_records[1] == (u'github.com', u'username', None, u'social code')
+    assert columns.password(1) == u'passw\u00f6rd'
+    assert columns.complete(columns.partial_records[2]) == records[2]
+    assert search('git', columns.partial_records)[0] is columns.partial_records[1]
+
+    assert decode(pack_columns([])) == []
+    with pytest.raises(ValueError):
+        pack_columns([(b'a', b'b', b'c', b'd')])
+    for end in range(len(COLUMNS_MAGIC), len(data)):
+        with pytest.raises(ValueError):
+            decode(data[:end])
+
+def test_iter_decode():
+    records = [random_tuple(4) for i in range(10)]
+    assert records == list(iter_decode(BytesIO(encode(records))))
+
+    # records come out before the rest of the input is read
+    f = BytesIO(encode(records) + b'this is not a record\n')
+    it = iter_decode(f)
+    assert next(it) == records[0]
+    with pytest.raises(SyntaxError):
+        list(it)
+
+    # search only needs to go through them once
+    records = [('google.com', 'username', 'password', 'notes')]
+    assert search('goo', iter_decode(encode(records))) == records
+
 def test_gen_password():
     pw = []
     for i in range(100):
@@ -40,6 +120,119 @@ def test_gen_password():
         assert 'a' in gen_password_require('a')
         assert 'b' in gen_password_require('ab')
 
+def test_gen_password_require():
+    assert 'a' in gen_password_require('a', 'ab', 1)
+    assert gen_password_require('ab', 'ab', 2) in ('ab', 'ba')
+    # b meets both
+    assert gen_password_require(['ab', 'bc'], 'abc', 1) == 'b'
+    pw = gen_password_require([string.digits, string.punctuation, 'xyz'], EVERYTHING, 3)
+    assert set(pw) & set(string.digits) and set(pw) & set(string.punctuation) and set(pw) & set('xyz')
+    for requirements, choices, length in [('abc', 'abc', 2), ('z', 'abc', 5), (['xy'], 'abc', 5)]:
+        with pytest.raises(Exception):
+            gen_password_require(requirements, choices, length)
+
+
+def test_password_counter():
+    rng = Random(0)
+    for i in range(50):
+        choices = ''.join(rng.sample('abcdef', rng.randint(1, 6)))
+        requirements = [''.join(rng.sample('abcdefg', rng.randint(1, 3))) for j in range(rng.randint(0, 3))]
+        length = rng.randint(0, 4)
+        classes = requirement_classes(requirements)
+        counter = PasswordCounter(choices, classes)
+        valid = [
+            pw for pw in itertools.product(choices, repeat=length)
+            if all(set(pw) & requirement for requirement in classes)
+        ]
+        assert counter.count(length, (1 << len(classes)) - 1) == len(valid)
+
+
+def test_password_counter_interchangeable():
+    rng = Random(0)
+    for i in range(50):
+        choices = ''.join(rng.sample('abcdef', rng.randint(1, 6)))
+        requirements = ''.join(rng.sample(choices, rng.randint(1, len(choices))))
+        length = rng.randint(0, 5)
+        counter = PasswordCounter(choices, requirement_classes(requirements))
+        assert counter.per_requirement == 1
+        valid = [pw for pw in itertools.product(choices, repeat=length) if set(requirements) <= set(pw)]
+        assert counter.count(length, (1 << len(requirements)) - 1) == len(valid)
+
+    # too many to count by subset
+    counter = PasswordCounter(string.ascii_lowercase, requirement_classes(string.ascii_lowercase))
+    assert counter.count(26, (1 << 26) - 1) == math.factorial(26)
+    assert counter.count(25, (1 << 26) - 1) == 0
+    pw = gen_password_require(string.punctuation, EVERYTHING, 40)
+    assert set(string.punctuation) <= set(pw)
+    with pytest.raises(ValueError):
+        gen_password_require(string.ascii_lowercase + u'\u2603', EVERYTHING, 40)
+
+
+def test_gen_password_require_uniform():
+    choices = 'abcd'
+    requirements = ['a', 'bc']
+    valid = [
+        ''.join(pw) for pw in itertools.product(choices, repeat=3)
+        if 'a' in pw and set(pw) & set('bc')
+    ]
+    tries = 200 * len(valid)
+    counts = {}
+    for i in range(tries):
+        pw = gen_password_require(requirements, choices, 3)
+        counts[pw] = counts.get(pw, 0) + 1
+    assert set(counts) == set(valid)
+    expected = tries / float(len(valid))
+    chi_squared = sum((count - expected) ** 2 / expected for count in counts.values())
+    # the mean is len(valid) - 1 = 23, and the standard deviation about 7
+    assert chi_squared < 23 + 10 * 7
+
+
+def test_gen_passwords():
+    passwords = list(gen_passwords(3000, EVERYTHING, 3))
+    assert len(passwords) == 3000
+    assert all(len(pw) == 3 and set(pw) <= set(EVERYTHING) for pw in passwords)
+    assert len(set(passwords)) > 2900
+    assert [len(pw) for pw in gen_passwords(2)] == [len(gen_password_entropy(128))] * 2
+    assert len(next(gen_passwords(1, entropy=64))) == 11
+    required = list(gen_passwords(100, requirements=['!'], choices=EVERYTHING, entropy=64))
+    assert all('!' in pw for pw in required)
+    # enough longer to make up for the entropy the requirement takes away
+    counter = PasswordCounter(EVERYTHING, requirement_classes(['!']))
+    assert counter.count(len(required[0]), 1) >= 2 ** 64 > counter.count(len(required[0]) - 1, 1)
+    with pytest.raises(ValueError):
+        next(gen_passwords(1, requirements=['!'], entropy=64))
+
+    assert list(gen_passwords(3, length=0)) == ['', '', '']
+    assert list(gen_passwords(2, entropy=0)) == ['', '']
+    assert list(gen_passwords(0)) == []
+    for kwargs in [dict(count=-1), dict(count=1, length=-1), dict(count=1, entropy=-8)]:
+        with pytest.raises(ValueError):
+            list(gen_passwords(**kwargs))
+
+
+def test_gen_passphrase():
+    words = set(WORDS)
+    passphrase = gen_passphrase()
+    # 128 bits, at log2(7776) bits a word
+    assert len(passphrase.split(' ')) == 10
+    assert set(passphrase.split(' ')) <= words
+    assert len(gen_passphrase(entropy=64).split(' ')) == 5
+    passphrase = gen_passphrase(words=4, separator='-', capitalize=True)
+    assert len(passphrase.split('-')) == 4
+    for word in passphrase.split('-'):
+        assert word == word.capitalize()
+        assert word.lower() in words
+    passphrases = list(gen_passphrases(3000, words=2))
+    assert len(passphrases) == 3000
+    assert len(set(passphrases)) > 2990
+
+    assert gen_passphrase(entropy=0) == ''
+    assert list(gen_passphrases(2, words=0)) == ['', '']
+    for kwargs in [dict(count=-1), dict(count=1, words=-1), dict(count=1, entropy=-8)]:
+        with pytest.raises(ValueError):
+            list(gen_passphrases(**kwargs))
+
+
 def test_match():
     assert match('a', 'a')
     assert match('', 'a')
@@ -74,6 +267,51 @@ def test_search():
     assert search('git', records) == [records[1], records[0]]
     assert len(search('o', records)) == 3
 
+def test_search_limit():
+    rng = Random(0)
+    records = [
+        tuple(''.join(rng.choice('abcde.') for i in range(rng.randint(0, 12))) for j in range(4))
+        for k in range(3000)
+    ]
+    for term in ['', 'a', 'ab', 'abc', 'e.a', 'aaaa', 'z']:
+        everything = search(term, records)
+        for limit in [1, 2, 5, 20, 5000]:
+            assert search(term, records, limit) == everything[:limit]
+
+
+def test_match_fields():
+    rng = Random(0)
+    for i in range(2000):
+        record = tuple(''.join(rng.choice('abc') for i in range(rng.randint(0, 6))) for j in range(4))
+        needle = ''.join(rng.choice('abc') for i in range(rng.randint(0, 4)))
+        assert match_fields(needle, record) == match(needle, record[0] + record[1] + record[3])
+        assert record_score(needle, record) == match(needle, record[0] + record[1] + record[3])
+    record = ('ab', 'cd', 'pw', 'xxxxe')
+    # 1 + 2 * 1 / (0 + 1) + 1 / (1 + 1)
+    assert match_fields('bd', record, weights=(2, 1, 1)) == 3.5
+    assert match_fields('bd', record, weights=(1, 2, 1)) == 3
+    assert record_score('e', record) == 2
+    assert record_score('e', record, notes_limit=4) == 0
+    assert record_score('ae', record, notes_limit=5) == 3
+    assert match_fields('a', ('ab', b'cd', 'pw', 'e')) == 2
+    assert match_fields('c', ('ab', b'cd', 'pw', 'e')) == 0
+
+
+def test_search_weights():
+    records = [
+        ('example.com', 'me', 'pw', 'github'),
+        ('github.com', 'me', 'pw', ''),
+        ('git.example.com', 'me', 'pw', 'hub'),
+    ]
+    assert search('hub', records) == [records[1], records[0], records[2]]
+    # only what's found in the notes counts
+    weighted = search('hub', records, weights=(0, 0, 1))
+    assert weighted == [records[0], records[2], records[1]]
+    assert search('hub', records, 2, weights=(0, 0, 1)) == weighted[:2]
+    assert search('hub', records, notes_limit=0) == [records[1]]
+    assert search('hub', records, 1, notes_limit=0) == [records[1]]
+
+
 def test_disambiguate():
     records = [
             ('google.com', 'username', 'password', 'lorem ipsum dolor sit amet'),
@@ -192,16 +430,46 @@ def test_atomic_replace():
     os.unlink(filename)
 
 
+def test_diff_records():
+    a = ('a', 'b', 'c', 'd')
+    b = ('e', 'f', 'g', 'h')
+    c = ('i', 'j', 'k', 'l')
+    cases = [
+        ([a, b], [a, b, c], [[('add',), c]]),
+        ([a, b], [a, c], [[('replace',), b, c]]),
+        ([a, b, c], [a, c], [[('delete',), b]]),
+        ([a, b, c], [a, b], [[('delete',), c]]),
+        ([a], [a], []),
+        ([a, b], [c], None),
+        ([a, b], [b, a], None),
+    ]
+    for current, records, deltas in cases:
+        assert diff_records(current, records) == deltas
+        if deltas is not None:
+            current = list(current)
+            for delta in deltas:
+                apply_delta(current, delta)
+            assert current == records
+
+
 class Empty(object):
     def __init__(self, **kwargs):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
 
+def unused_filename():
+    """
+    The name of a temporary file that doesn't exist.
+    """
+    filename = NamedTemporaryFile(delete=False).name
+    os.unlink(filename)
+    return filename
+
+
 class TestInteractive(TestCase):
     def setUp(self):
-        self.filename = NamedTemporaryFile(delete=False).name
-        os.unlink(self.filename)
+        self.filename = unused_filename()
         self.args = Empty(file=self.filename)
 
     def tearDown(self):
@@ -277,6 +545,46 @@ class TestInteractive(TestCase):
         assert pw != 'password'
         assert output == 'otheruse@other.com: notas\n'
 
+    def test_gen_action(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        self.args = Empty(
+            file=self.filename, count=3, charset='everything', length=12, entropy=128,
+            require=['0123456789'], add='svc{n}.com', username='deploy', notes=None)
+        session = InteractiveSession(self.args, password='asdf')
+        session.gen_action()
+        records = session.read_records()
+        assert [r[0] for r in records] == ['domain.com', 'svc1.com', 'svc2.com', 'svc3.com']
+        for record in records[1:]:
+            assert record[1] == 'deploy'
+            assert len(record[2]) == 12
+            assert set(record[2]) & set('0123456789')
+
+        # bad options are ValueErrors, found before the file is touched
+        before = self.file_contents()
+        for bad in [dict(add='svc{}.com'), dict(add='svc{m}.com'), dict(length=-1),
+                    dict(require=[u'\u2603'])]:
+            args = Empty(**dict(vars(self.args), **bad))
+            with pytest.raises(ValueError):
+                gen_args_records(args)
+            with pytest.raises(ValueError):
+                InteractiveSession(args, password='asdf').gen_action()
+        assert self.file_contents() == before
+
+    def test_add_diceware(self):
+        self.add_a_password('domain.com', 'username', 'd', '')
+        self.add_a_password('other.com', 'username', 'g', '')
+        pw, output = self.get_a_password('domain.com')
+        assert len(pw.split(' ')) == 10
+        pw, output = self.get_a_password('other.com')
+        assert len(pw) == 22
+
+        input = StringIO("\n\nd\n\n")
+        self.args.domain = 'other.com'
+        session = InteractiveSession(self.args, input=input, output=StringIO(), password='asdf')
+        session.edit_action()
+        pw, output = self.get_a_password('other.com')
+        assert len(pw.split(' ')) == 10
+
     def test_edit_action(self):
         self.add_a_password('domain.com', 'username', 'password', '')
         self.add_a_password('other.com', 'otheruse', 'abc', 'notas')
@@ -347,6 +655,229 @@ class TestInteractive(TestCase):
         pw, output = self.get_a_password('unrel')
         assert output == 'aaa@unrelated.com: notes\n'
 
+    def test_migrate(self):
+        records = [('domain.com', 'usernamet', 'password', '')]
+        with open(self.filename, 'wb') as f:
+            f.write(encrypt('asdf', encode(records)))
+
+        session = InteractiveSession(self.args, password='asdf')
+        assert session.read_records() == records
+        self.add_a_password('other.com', 'otheruse', 'abc', 'notas')
+
+        with open(self.filename, 'rb') as f:
+            plaintext = decrypt('asdf', f.read())
+        assert plaintext.startswith(PACKED_MAGIC)
+        assert decode(plaintext) == records + [('other.com', 'otheruse', 'abc', 'notas')]
+
+    def test_columns(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        self.args.layout = 'columns'
+        InteractiveSession(self.args, password='asdf').convert_action()
+        with open(self.filename, 'rb') as f:
+            assert decrypt('asdf', f.read()).startswith(COLUMNS_MAGIC)
+
+        # stays columnar
+        self.add_a_password('other.com', 'otheruse', 'abc', 'notas')
+        with open(self.filename, 'rb') as f:
+            assert decrypt('asdf', f.read()).startswith(COLUMNS_MAGIC)
+
+        pw, output = self.get_a_password('other')
+        assert pw == 'abc'
+        assert output == 'otheruse@other.com: notas\n'
+
+    def test_binary(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        assert self.file_contents().startswith(b'-----BEGIN PGP MESSAGE-----')
+
+        self.args.armor = False
+        InteractiveSession(self.args, password='asdf').convert_action()
+        assert not self.file_contents().startswith(b'-----BEGIN')
+        with open(self.filename, 'rb') as f:
+            plaintext = decrypt('asdf', f.read())
+        assert plaintext.startswith(PACKED_MAGIC)
+
+        # stays binary
+        del self.args.armor
+        self.add_a_password('other.com', 'otheruse', 'abc', 'notas')
+        assert not self.file_contents().startswith(b'-----BEGIN')
+        pw, output = self.get_a_password('other')
+        assert pw == 'abc'
+
+        self.args.armor = True
+        InteractiveSession(self.args, password='asdf').convert_action()
+        assert self.file_contents().startswith(b'-----BEGIN PGP MESSAGE-----')
+        assert len(InteractiveSession(self.args, password='asdf').read_records()) == 2
+
+    def file_contents(self):
+        with open(self.filename, 'rb') as f:
+            return f.read()
+
+    def test_journal(self):
+        import sdb.passwords
+        self.add_a_password('domain.com', 'username', 'password', '')
+        before = self.file_contents()
+
+        self.args.journal = True
+        self.add_a_password('other.com', 'otheruse', 'abc', 'notas')
+        self.add_a_password('unrelated.com', 'aaa', 'foobar', 'notes')
+        self.args.domain = 'unrel'
+        InteractiveSession(self.args, input=StringIO('y\n'), output=StringIO(), password='asdf').delete_action()
+        assert self.file_contents() == before
+
+        pw, output = self.get_a_password('other')
+        assert pw == 'abc'
+        session = InteractiveSession(self.args, password='asdf')
+        assert session.read_records() == [
+            ('domain.com', 'username', 'password', ''),
+            ('other.com', 'otheruse', 'abc', 'notas'),
+        ]
+
+        # an entry that didn't get written completely is ignored
+        with open(get_journal_file(self.filename), 'ab') as f:
+            f.write(b'500\n-----BEGIN PGP')
+        assert session.read_records() == InteractiveSession(self.args, password='asdf').read_records()
+
+        session.compact_action()
+        assert self.file_contents() != before
+        assert session.read_journal() == []
+        assert InteractiveSession(self.args, password='asdf').read_records() == [
+            ('domain.com', 'username', 'password', ''),
+            ('other.com', 'otheruse', 'abc', 'notas'),
+        ]
+
+        # and compacted automatically once it's big enough
+        compact_entries = sdb.passwords.JOURNAL_COMPACT_ENTRIES
+        sdb.passwords.JOURNAL_COMPACT_ENTRIES = 1
+        try:
+            self.add_a_password('new.com', 'u', 'p', '')
+            self.add_a_password('newer.com', 'u', 'p', '')
+        finally:
+            sdb.passwords.JOURNAL_COMPACT_ENTRIES = compact_entries
+        # the first went in the journal, the second compacted it
+        session = InteractiveSession(self.args, password='asdf')
+        assert session.read_journal() == []
+        assert len(session.read_records()) == 4
+
+    def test_journal_torn_entry(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        self.args.journal = True
+        self.add_a_password('other.com', 'u', 'p', '')
+        with open(get_journal_file(self.filename), 'ab') as f:
+            f.write(b'500\n\x01torn')
+        # the adds after it write over it
+        for i in range(4):
+            self.add_a_password('%d.com' % i, 'u', 'p', '')
+        session = InteractiveSession(self.args, password='asdf')
+        assert [r[0] for r in session.read_records()] == [
+            'domain.com', 'other.com', '0.com', '1.com', '2.com', '3.com']
+
+        # but one that isn't at the end is corruption
+        with open(get_journal_file(self.filename), 'rb') as f:
+            journal = f.read()
+        header, key_packet, rest = journal.split(b'\n', 2)
+        length, entry = rest.split(b'\n', 1)
+        flipped = bytearray(entry)
+        flipped[-5] ^= 1
+        with open(get_journal_file(self.filename), 'wb') as f:
+            f.write(b'\n'.join([header, key_packet, length, bytes(flipped)]))
+        with pytest.raises(FileCorruptionException):
+            InteractiveSession(self.args, password='asdf').read_records()
+
+    def test_journal_key(self):
+        from sdb import openpgp
+        with use_backend('openpgp'):
+            self.add_a_password('domain.com', 'username', 'password', '')
+            self.args.journal = True
+            derived = []
+            s2k = openpgp.s2k
+
+            def counting_s2k(*args):
+                derived.append(args)
+                return s2k(*args)
+            openpgp.s2k = counting_s2k
+            try:
+                session = InteractiveSession(self.args, password='asdf')
+                for i in range(5):
+                    session.edit_transaction(lambda records: records + [('%d.com' % i, 'u', 'p', '')])
+                # the file each time, and the journal's key once
+                assert len(derived) == 5 + 1
+                del derived[:]
+                assert len(session.read_records()) == 6
+                assert len(derived) == 1
+                del derived[:]
+                assert len(InteractiveSession(self.args, password='asdf').read_records()) == 6
+                assert len(derived) == 2
+            finally:
+                openpgp.s2k = s2k
+
+            # an entry after the key packet is an ordinary message
+            with open(get_journal_file(self.filename), 'rb') as f:
+                f.readline()
+                key_packet = binascii.unhexlify(f.readline().rstrip(b'\n'))
+                length = int(f.readline())
+                entry = f.read(length)
+            assert decode(decrypt('asdf', key_packet + entry)) == [(u'add',), ('0.com', 'u', 'p', '')]
+
+    def test_journal_without_key(self):
+        # without in-process AES each entry is a message of its own
+        with use_backend('gpg'):
+            self.add_a_password('domain.com', 'username', 'password', '')
+            self.args.journal = True
+            self.add_a_password('other.com', 'u', 'p', '')
+            self.add_a_password('new.com', 'u', 'p', '')
+            with open(get_journal_file(self.filename), 'rb') as f:
+                f.readline()
+                assert f.readline() == b'\n'
+                length = int(f.readline())
+                entry = f.read(length)
+            assert decode(decrypt('asdf', entry)) == [(u'add',), ('other.com', 'u', 'p', '')]
+            assert [r[0] for r in InteractiveSession(self.args, password='asdf').read_records()] == [
+                'domain.com', 'other.com', 'new.com']
+
+    def test_verify(self):
+        for level in VERIFY_LEVELS:
+            self.args.verify = level
+            self.add_a_password('%s.com' % level, 'username', 'password', '')
+        session = InteractiveSession(self.args, password='asdf')
+        assert [r[0] for r in session.read_records()] == ['full.com', 'digest.com', 'async.com']
+
+    def test_verify_digest_mismatch(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        before = self.file_contents()
+        session = InteractiveSession(self.args, password='asdf')
+        session.verify = 'digest'
+        backend = get_backend()
+        real_encrypt_digest = backend.encrypt_digest
+        backend.encrypt_digest = lambda pw, data, armor, settings: real_encrypt_digest(pw, data + b'x', armor, settings)
+        import sdb.passwords
+        get = sdb.passwords.get_backend
+        sdb.passwords.get_backend = lambda: backend
+        try:
+            with pytest.raises(AssertionError):
+                session.edit_transaction(lambda records: records + [('other.com', 'u', 'p', '')])
+        finally:
+            sdb.passwords.get_backend = get
+        assert self.file_contents() == before
+
+    def test_verify_async_rollback(self):
+        self.add_a_password('domain.com', 'username', 'password', '')
+        before = self.file_contents()
+        session = InteractiveSession(self.args, password='asdf')
+        session.verify = 'async'
+
+        def check_encrypted(ciphertext, plaintext):
+            raise ValueError('wrong')
+        session.check_encrypted = check_encrypted
+        with pytest.raises(ValueError):
+            session.edit_transaction(lambda records: records + [('other.com', 'u', 'p', '')])
+        assert self.file_contents() == before
+
+        # a new file is removed again
+        os.unlink(self.filename)
+        with pytest.raises(ValueError):
+            session.edit_transaction(lambda records: [('other.com', 'u', 'p', '')])
+        assert not os.path.exists(self.filename)
+
     def test_raw(self):
         records = [
             ('domain.com', 'usernamet', 'password', ''),
@@ -362,3 +893,61 @@ class TestInteractive(TestCase):
         session.raw_action()
 
         assert output.getvalue() == encode(records)
+
+
+def test_dencrypt_big_input():
+    # more than fits in a pipe, in both directions
+    data = os.urandom(4 * 1024 * 1024)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(dencrypt(['cat'], 'pw', data)))
+    thread.daemon = True
+    thread.start()
+    thread.join(60)
+    assert result == [b'pw\n' + data]
+
+    output = BytesIO()
+    dencrypt(['cat'], 'pw', BytesIO(data), output=output)
+    assert output.getvalue() == b'pw\n' + data
+
+
+def test_dencrypt_stream():
+    with dencrypt_stream(['cat'], 'pw', BytesIO(b'data')) as output:
+        assert output.read() == b'pw\ndata'
+
+    # stopping early
+    with dencrypt_stream(['cat'], 'pw', BytesIO(b'x' * 1024 * 1024)) as output:
+        assert output.read(3) == b'pw\n'
+
+    with pytest.raises(IncorrectPasswordException):
+        with dencrypt_stream(SubprocessBackend.decrypt_command, 'wrong', BytesIO(encrypt('pw', b'data'))) as output:
+            assert output.read() == b''
+
+
+@pytest.mark.skipif(not os.environ.get('SDB_STRESS'), reason="set SDB_STRESS to run")
+@pytest.mark.parametrize('backend', [None, 'gpg', 'openpgp'])
+def test_stream_big_vault(monkeypatch, backend):
+    import resource
+    if backend:
+        monkeypatch.setenv('SDB_BACKEND', backend)
+    else:
+        monkeypatch.delenv('SDB_BACKEND', raising=False)
+    notes = 'n' * (1024 * 1024)
+    count = 300
+    filename = NamedTemporaryFile(delete=False).name
+    try:
+        with NamedTemporaryFile() as plaintext:
+            plaintext.write(PACKED_MAGIC)
+            for i in range(count):
+                plaintext.write(pack([('domain%d.com' % i, 'user', 'pw', notes)])[len(PACKED_MAGIC):])
+            plaintext.flush()
+            plaintext.seek(0)
+            with open(filename, 'wb') as f:
+                SubprocessBackend().encrypt('asdf', plaintext, output=f)
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        session = InteractiveSession(Empty(file=filename), password='asdf')
+        assert sum(1 for record in session.iter_records()) == count
+        # kilobytes on linux. A record at a time, not the whole vault.
+        assert resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before < 64 * 1024
+    finally:
+        os.unlink(filename)
@@ -0,0 +1,88 @@
+import pytest
+
+from sdb.passwords import search, search_folded
+from sdb.picker import *
+
+from test_index import random_records, MIXED
+
+
+RECORDS = [
+    ('github.com', 'me', 'pw', ''),
+    ('gitlab.com', 'me', 'pw', ''),
+    ('google.com', 'me', 'pw', ''),
+    ('example.com', 'you', 'pw', 'notes'),
+]
+
+
+def test_typing():
+    picker = Picker(RECORDS, 'g')
+    assert len(picker) == 3
+    for c in 'itl':
+        assert picker.key(c, 10) is None
+    assert picker.term == 'gitl'
+    assert picker.choice() == RECORDS[1]
+    picker.key(KEY_BACKSPACE, 10)
+    picker.key('\x7f', 10)
+    assert picker.term == 'gi'
+    assert [f.record for f in picker.visible(10)] == search('gi', RECORDS)
+    picker.key(CTRL_U, 10)
+    assert picker.term == ''
+    assert len(picker) == len(RECORDS)
+
+
+def test_moving():
+    records = random_records(500)
+    picker = Picker(records)
+    results = search('', records)
+    assert [f.record for f in picker.visible(10)] == results[:10]
+    for i in range(12):
+        picker.key(KEY_DOWN, 10)
+    assert picker.selected == 12
+    assert [f.record for f in picker.visible(10)] == results[3:13]
+    assert picker.choice() == results[12]
+    picker.key(KEY_PAGE_UP, 10)
+    assert picker.selected == 2
+    assert [f.record for f in picker.visible(10)] == results[2:12]
+    picker.key(CTRL_P, 10)
+    picker.key(CTRL_P, 10)
+    picker.key(CTRL_P, 10)
+    assert picker.selected == 0
+    for i in range(100):
+        picker.key(KEY_PAGE_DOWN, 10)
+    assert picker.selected == len(records) - 1
+    assert picker.key('\n', 10) == results[-1]
+    # typing starts from the top again
+    picker.key('a', 10)
+    assert picker.selected == picker.offset == 0
+
+
+def test_choose_and_cancel():
+    picker = Picker(RECORDS, 'gh')
+    assert picker.key('\r', 10) == RECORDS[0]
+    with pytest.raises(KeyboardInterrupt):
+        picker.key(ESCAPE, 10)
+    picker.set_term('zzz')
+    assert picker.visible(10) == []
+    assert picker.key('\n', 10) is None
+
+
+def test_describe():
+    assert describe(RECORDS[3]) == ('you@example.com: notes', {1: 0, 0: 4, 3: 17})
+
+
+def test_folding():
+    records = RECORDS + [(u'G\u00cdTHUB.com', u'Me', u'pw', u'')]
+    picker = Picker(records, u'GitH')
+    assert picker.term == u'GitH'
+    assert [f.record for f in picker.visible(10)] == [RECORDS[0], records[4]]
+    line = describe(records[4])[0]
+    # the G and I of the domain, then the e of the username
+    picker.set_term(u'gie')
+    assert [line[i] for i in picker.highlights(picker.visible(10)[0])] == [u'G', u'\u00cd', u'e']
+
+
+def test_mixed():
+    picker = Picker(MIXED)
+    for term in ['a', 'ab', 'au', '']:
+        picker.set_term(term)
+        assert [r.record for r in picker.visible(10)] == search_folded(term, MIXED)
@@ -0,0 +1,67 @@
+import os
+import itertools
+from collections import Counter
+
+from sdb.randomness import *
+
+
+def chi_squared(counts, n, total):
+    expected = total / float(n)
+    return sum((counts.get(i, 0) - expected) ** 2 / expected for i in range(n))
+
+
+def check_uniform(values, n):
+    counts = Counter(values)
+    assert set(counts) <= set(range(n))
+    # the mean is n - 1 and the standard deviation sqrt(2(n - 1)), so this
+    # fails about once in 10**12 tries
+    assert chi_squared(counts, n, len(values)) < n - 1 + 10 * (2 * (n - 1)) ** .5 + 20
+
+
+def test_uniform():
+    source = RandomSource()
+    for n in [2, 3, 10, 62, 94, 129, 200, 256]:
+        check_uniform(source.indices(n, 200 * n), n)
+    for n in [257, 1000, 7776, 65536]:
+        check_uniform(source.indices(n, 20 * n), n)
+    for n in [257, 7776, 70000]:
+        check_uniform([source.below(n) for i in range(20 * n)], n)
+    check_uniform([source.below(5) for i in range(1000)], 5)
+
+
+def test_rejection():
+    # 3 needs two bits, and 3 is rejected
+    counter = itertools.count()
+    source = RandomSource(pool_size=4, urandom=lambda n: bytes(bytearray(next(counter) % 256 for i in range(n))))
+    assert source.indices(3, 6) == [0, 1, 2, 0, 1, 2]
+    assert [source.below(3) for i in range(3)] == [0, 1, 2]
+    assert source.choices('abc', 4) == ['a', 'b', 'c', 'a']
+    assert source.below(1) == 0
+    # 300 needs nine bits, so 0xffff is 511 and rejected, and 0x0101 is 257
+    pairs = iter([b'\xff\xff\x01\x01', b'\x05\x05'] + [b'\x00' * 4] * 10)
+    source = RandomSource(pool_size=2, urandom=lambda n: next(pairs)[:n])
+    assert source.indices(300, 2) == [257, 261]
+
+
+def test_wipe():
+    source = RandomSource(pool_size=64)
+    first = source.read(10)
+    assert len(first) == 10
+    assert source.pool[:10] == bytearray(10)
+    assert source.pool[10:] != bytearray(54)
+    rest = source.read(100)
+    assert len(rest) == 100
+    source.wipe()
+    assert source.pool == bytearray(len(source.pool))
+    assert len(source.read(5)) == 5
+
+
+def test_fork():
+    source = RandomSource()
+    source.read(1)
+    pool = source.pool
+    source.pid = -1
+    source.read(1)
+    # the old pool is wiped, and a new one is read
+    assert pool == bytearray(len(pool))
+    assert source.pid == os.getpid()
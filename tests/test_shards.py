@@ -0,0 +1,189 @@
+import os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from unittest import TestCase
+
+from sdb.passwords import InteractiveSession, encrypt, decrypt, pack, decode_layout, get_backup_file
+from sdb import openpgp
+from sdb.shards import *
+
+from test_passwords import Empty, unused_filename, use_backend
+
+
+RECORDS = [
+    ('domain%d.com' % i, 'username', 'password%d' % i, '')
+    for i in range(20)
+]
+
+
+def test_manifest():
+    manifest = Manifest.create('/tmp/.passwords', 8)
+    assert len(manifest.segments) == 8
+    assert all(i.startswith('.passwords.shard-') for i in manifest.segments)
+
+    decoded = Manifest.decode('/tmp/.passwords', manifest.encode()[len(SHARDS_MAGIC):])
+    assert decoded.key == manifest.key
+    assert decoded.data_key == manifest.data_key
+    assert decoded.segments == manifest.segments
+    assert decoded.path(3) == os.path.join('/tmp', manifest.segments[3])
+
+    parts = manifest.partition(RECORDS)
+    assert sorted(sum(parts, [])) == sorted(RECORDS)
+    for i, part in enumerate(parts):
+        for record in part:
+            assert manifest.shard(record[0]) == i
+
+    new = manifest.replace([2])
+    assert new.data_key == manifest.data_key
+    assert new.segments[2] != manifest.segments[2]
+    assert new.segments[:2] == manifest.segments[:2]
+    assert new.segments[3:] == manifest.segments[3:]
+
+
+class TestShards(TestCase):
+    # gpg, so the segments are encrypted with the password
+    backend = 'gpg'
+
+    def setUp(self):
+        backend = use_backend(self.backend)
+        backend.__enter__()
+        self.addCleanup(backend.__exit__, None, None, None)
+        self.filename = unused_filename()
+        self.args = Empty(file=self.filename, layout='shards', shards=4, exact=False)
+        self.session().edit_transaction(lambda records: RECORDS)
+        self.session().convert_action()
+
+    def tearDown(self):
+        remove_unused_segments(self.filename)
+        for name in [self.filename, get_backup_file(self.filename)]:
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+
+    def session(self, input=''):
+        return InteractiveSession(self.args, input=StringIO(input), output=StringIO(), password='asdf')
+
+    def manifest(self):
+        with open(self.filename, 'rb') as f:
+            layout, data = decode_layout(decrypt('asdf', f.read()))
+        assert layout == 'shards'
+        return Manifest.decode(self.filename, data)
+
+    def test_read(self):
+        assert len(self.manifest().segments) == 4
+        assert sorted(self.session().read_records()) == sorted(RECORDS)
+
+    def test_write_one_segment(self):
+        before = self.manifest()
+        self.args.domain = 'new.com'
+        self.session('user\npw\n\n').add_action()
+        after = self.manifest()
+
+        changed = [i for i in range(4) if before.segments[i] != after.segments[i]]
+        assert changed == [after.shard('new.com')]
+        assert sorted(self.session().read_records()) == sorted(RECORDS + [('new.com', 'user', 'pw', '')])
+
+        # the segments of the previous write are kept as a backup
+        assert os.path.exists(before.path(changed[0]))
+
+    def test_password_segments(self):
+        # manifests from before they had a key of their own
+        manifest = self.manifest()
+        parts = manifest.partition(RECORDS)
+        manifest.data_key = None
+        for i, part in enumerate(parts):
+            with open(manifest.path(i), 'wb') as f:
+                f.write(encrypt('asdf', pack(part)))
+        with open(self.filename, 'wb') as f:
+            f.write(encrypt('asdf', manifest.encode()))
+        assert sorted(self.session().read_records()) == sorted(RECORDS)
+
+        # a write gives it one, if it can be used
+        self.session().edit_transaction(
+            lambda records: [r for r in records if r != RECORDS[0]], domains=[RECORDS[0][0]])
+        assert bool(self.manifest().data_key) == (self.backend == 'openpgp')
+        assert sorted(self.session().read_records()) == sorted(RECORDS[1:])
+
+    def test_exact(self):
+        manifest = self.manifest()
+        shard = manifest.shard('domain3.com')
+        # only the segment for domain3.com is decrypted
+        for i in range(4):
+            if i != shard:
+                os.unlink(manifest.path(i))
+        self.args.exact = True
+        self.args.domain = 'domain3.com'
+        assert self.session().show_action(clipboard=False) == 'password3'
+
+    def test_unshard(self):
+        manifest = self.manifest()
+        self.args.layout = 'packed'
+        self.session().convert_action()
+        assert sorted(self.session().read_records()) == sorted(RECORDS)
+        assert all(os.path.exists(manifest.path(i)) for i in range(4))
+
+        # once the backup no longer refers to the segments, they're removed
+        self.session().edit_transaction(lambda records: records[1:])
+        assert not any(os.path.exists(manifest.path(i)) for i in range(4))
+
+    def test_binary(self):
+        before = self.manifest()
+        self.args.layout = None
+        self.args.shards = None
+        self.args.armor = False
+        self.session().convert_action()
+        after = self.manifest()
+        assert after.key == before.key
+        assert len(after.segments) == 4
+        for i in range(4):
+            assert after.segments[i] != before.segments[i]
+            with open(after.path(i), 'rb') as f:
+                assert not f.read().startswith(b'-----BEGIN')
+        assert sorted(self.session().read_records()) == sorted(RECORDS)
+
+    def test_remove_unused_segments(self):
+        manifest = self.manifest()
+        leftover = os.path.join(os.path.dirname(self.filename), new_segment_name(self.filename, 0))
+        with open(leftover, 'w') as f:
+            f.write('from a crashed write')
+        remove_unused_segments(self.filename, manifest)
+        assert not os.path.exists(leftover)
+        assert all(os.path.exists(manifest.path(i)) for i in range(4))
+
+
+class TestKeyedShards(TestShards):
+    # the segments are encrypted with a key of their own
+    backend = 'openpgp'
+
+    def test_one_s2k(self):
+        before = self.manifest()
+        session = self.session('user\npw\n\n')
+        decrypted = []
+        decrypt_segment = session.decrypt_segment
+
+        def counting_decrypt_segment(filename):
+            decrypted.append(filename)
+            return decrypt_segment(filename)
+        session.decrypt_segment = counting_decrypt_segment
+        derived = []
+        s2k = openpgp.s2k
+
+        def counting_s2k(*args):
+            derived.append(args)
+            return s2k(*args)
+        openpgp.s2k = counting_s2k
+        try:
+            self.args.domain = 'new.com'
+            session.add_action()
+            # only the segment the record goes in is read, and only the
+            # manifest is encrypted with the password
+            assert decrypted == [before.path(before.shard('new.com'))]
+            assert len(derived) == 2
+            del derived[:]
+            assert len(session.read_records()) == len(RECORDS) + 1
+            assert len(derived) == 1
+        finally:
+            openpgp.s2k = s2k
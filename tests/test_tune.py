@@ -0,0 +1,71 @@
+import os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from unittest import TestCase
+
+from sdb import openpgp
+from sdb.config import *
+from sdb.tune import *
+from sdb.passwords import InteractiveSession
+
+from test_passwords import Empty, unused_filename
+
+
+def test_largest_s2k_count():
+    assert largest_s2k_count(0) == MIN_S2K_COUNT
+    assert largest_s2k_count(10 ** 9) == MAX_S2K_COUNT
+    for count in [65536, 100000, 1000000, 20000000]:
+        result = largest_s2k_count(count)
+        assert result <= count
+        assert openpgp.decode_s2k_count(openpgp.encode_s2k_count(result)) == result
+        assert openpgp.decode_s2k_count(openpgp.encode_s2k_count(result) + 1) > count
+
+
+class TestTune(TestCase):
+    def setUp(self):
+        self.filename = unused_filename()
+        self.args = Empty(file=self.filename, target=20)
+
+    def tearDown(self):
+        for name in [self.filename, get_config_file(self.filename)]:
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+
+    def test_config(self):
+        assert read_encryption_settings(self.filename) == ENCRYPTION_DEFAULTS
+        write_encryption_settings(self.filename, {'cipher': 'AES256', 's2k_count': 1024})
+        settings = read_encryption_settings(self.filename)
+        assert settings['cipher'] == 'AES256'
+        assert settings['s2k_count'] == 1024
+        assert settings['digest'] == ENCRYPTION_DEFAULTS['digest']
+
+    def test_tune_action(self):
+        session = InteractiveSession(self.args, password='asdf')
+        session.edit_transaction(lambda records: [('domain.com', 'username', 'password', '')])
+
+        output = StringIO()
+        InteractiveSession(self.args, output=output, password='asdf').tune_action()
+        settings = read_encryption_settings(self.filename)
+        assert settings['cipher'] in CIPHERS
+        assert settings['digest'] in DIGESTS
+        assert settings['compression'] in COMPRESSIONS
+        assert MIN_S2K_COUNT <= settings['s2k_count'] <= MAX_S2K_COUNT
+        assert 'Using' in output.getvalue()
+
+        # the file was rewritten with them
+        with open(self.filename, 'rb') as f:
+            tag, body = next(openpgp.read_packets(openpgp.dearmor(f.read())))
+        assert tag == 3
+        body = bytearray(body)
+        assert body[1] == openpgp.CIPHERS[settings['cipher']]
+        assert body[3] == openpgp.HASHES[settings['digest']]
+        assert openpgp.decode_s2k_count(body[12]) == settings['s2k_count']
+
+        # and the next write uses them too
+        self.args.domain = 'other.com'
+        InteractiveSession(self.args, input=StringIO('u\np\n\n'), output=StringIO(), password='asdf').add_action()
+        assert len(InteractiveSession(self.args, password='asdf').read_records()) == 2
@@ -0,0 +1,44 @@
+import pytest
+
+from sdb.passwords import search, record_score
+from sdb.vectorized import *
+
+from test_index import random_records, MIXED
+
+TERMS = ['', 'a', 'ab', 'aab', 'xyz', '\xe9.', 'q', 'aaaaaaaa', 'ABe', 'cba']
+
+
+def test_python_fallback():
+    records = random_records(500)
+    searcher = BulkSearcher(records, use_numpy=False)
+    for term in TERMS:
+        assert searcher.search(term) == search(term, records)
+
+
+def test_numpy():
+    pytest.importorskip('numpy')
+    records = random_records(2000)
+    # some long ones, in their own group
+    records += [('a' * 100, 'b' * 50, '', 'c' * 300), ('x.com', 'y', '', 'ab' * 1000)]
+    searcher = BulkSearcher(records)
+    assert searcher.use_numpy
+    for term in TERMS:
+        assert list(searcher.scores(term)) == [record_score(term, r) for r in records]
+        assert searcher.search(term) == search(term, records)
+
+
+def test_bytes():
+    pytest.importorskip('numpy')
+    records = [(b'a.com', b'user', b'pw', b''), ('a.com', 'user', 'pw', '')]
+    searcher = BulkSearcher(records)
+    assert searcher.search('a') == search('a', records)
+    assert searcher.search('') == search('', records)
+
+
+def test_mixed():
+    assert code_points(haystack(MIXED[0])) == [ord(c) for c in 'a.com']
+    assert code_points(haystack(MIXED[1])) == []
+    for use_numpy in (False, True):
+        searcher = BulkSearcher(MIXED, use_numpy)
+        for term in ['', 'a', 'ab', 'au', 'an']:
+            assert searcher.search(term) == search(term, MIXED)